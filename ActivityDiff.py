@@ -0,0 +1,108 @@
+import re
+
+from GhostfolioApi import GhostfolioImportActivity
+
+SYNC_COMMENT_PATTERN = re.compile(
+    r"<sync-trade-transactionID>([^<]*)</sync-trade-transactionID>")
+
+
+def format_act(act: GhostfolioImportActivity):
+    return {
+        "accountId": act.accountId,
+        "date": act.date[0:18],
+        "fee": float(act.fee),
+        "quantity": act.quantity,
+        "symbol": act.symbol,
+        "type": act.type,
+        "unitPrice": act.unitPrice,
+    }
+
+
+def activity_key(act: GhostfolioImportActivity):
+    # same fields and normalization as format_act, but hashable
+    return act.key()
+
+
+def is_act_present(
+        act_search: GhostfolioImportActivity,
+        acts: list[GhostfolioImportActivity]
+):
+    # if sync has written id as comment,
+    # extract it, it could be the transaction id
+    comment = act_search.comment
+
+    for act in acts:
+        potential_match_comment = act.comment
+        if comment is not None \
+                and potential_match_comment is not None \
+                and comment.startswith(potential_match_comment):
+            return True
+        act1 = format_act(act)
+        act2 = format_act(act_search)
+        if act1 == act2:
+            return True
+    return False
+
+
+class ActivityIndex:
+    """
+    Index over existing activities, built once per diff.
+
+    Answers the same question as is_act_present, but in O(1) per lookup:
+    an existing activity matches if its comment is a prefix of the searched
+    comment, or if both format_act to the same values.
+    """
+
+    def __init__(self, acts: list[GhostfolioImportActivity]):
+        self.transaction_ids = set()
+        # comments not written by the sync, grouped by length for prefix lookups
+        self.other_comments = {}
+        # key hash -> activity, or list of activities when hashes collide;
+        # keys are only built for activities with the same hash, so no key
+        # tuple is kept per activity
+        self.keys = {}
+        for act in acts:
+            if act.comment is not None:
+                match = SYNC_COMMENT_PATTERN.fullmatch(act.comment)
+                if match:
+                    self.transaction_ids.add(match.group(1))
+                else:
+                    self.other_comments.setdefault(len(act.comment), set()) \
+                        .add(act.comment)
+            same_hash = self.keys.get(act.key_hash)
+            if same_hash is None:
+                self.keys[act.key_hash] = act
+            elif isinstance(same_hash, list):
+                same_hash.append(act)
+            else:
+                self.keys[act.key_hash] = [same_hash, act]
+
+    def __contains__(self, act_search: GhostfolioImportActivity):
+        if not self.keys:
+            return False
+        comment = act_search.comment
+        if comment is not None:
+            # a sync comment "<tag>id</tag>" is a prefix of the searched comment
+            # exactly when the searched comment starts with the same tag
+            match = SYNC_COMMENT_PATTERN.match(comment)
+            if match and match.group(1) in self.transaction_ids:
+                return True
+            for length, comments in self.other_comments.items():
+                if length <= len(comment) and comment[:length] in comments:
+                    return True
+        same_hash = self.keys.get(act_search.key_hash)
+        if same_hash is None:
+            return False
+        key = activity_key(act_search)
+        if isinstance(same_hash, list):
+            return any(activity_key(act) == key for act in same_hash)
+        return activity_key(same_hash) == key
+
+
+def get_diff(existing_acts, new_acts: list[GhostfolioImportActivity]):
+    index = ActivityIndex(existing_acts)
+    diff = []
+    for new_act in new_acts:
+        if new_act not in index:
+            diff.append(new_act)
+    return diff
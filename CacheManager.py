@@ -0,0 +1,147 @@
+import hashlib
+import threading
+from collections import namedtuple
+
+import LoggerFactory
+from EnvironmentConfiguration import EnvironmentConfiguration
+from SymbolIndex import symbol_index
+
+CacheNamespace = namedtuple('CacheNamespace', 'size_limit_mb eviction_policy')
+CacheStats = namedtuple('CacheStats',
+                        'namespace items size_bytes size_limit_bytes '
+                        'eviction_policy hits misses')
+
+# namespace -> defaults, overridden by CACHE_SIZE_LIMITS and
+# CACHE_EVICTION_POLICIES; the sync state is never evicted, losing it only
+# costs a full reconcile but evicting it by size would do so at random
+NAMESPACES = {
+    "ghostfolio-api": CacheNamespace(16, "least-recently-used"),
+    "ibkr-api": CacheNamespace(256, "least-recently-stored"),
+    "sync-state": CacheNamespace(64, "none"),
+}
+EVICTION_POLICIES = {"least-recently-stored", "least-recently-used",
+                     "least-frequently-used", "none"}
+
+# tags of entries that can be invalidated on their own
+TAG_ACCOUNTS = "accounts"
+TAG_QUERY = "query"
+TAG_PLATFORM = "platform"
+
+envConf = EnvironmentConfiguration()
+logger = LoggerFactory.logger
+
+caches = {}
+caches_lock = threading.Lock()
+
+
+def get_cache(namespace):
+    """The diskcache Cache of a namespace, below FILE_WRITE_LOCATION/.cache."""
+    with caches_lock:
+        if namespace not in caches:
+            from diskcache import Cache
+
+            config = get_namespace_config(namespace)
+            cache = Cache(
+                directory=envConf.file_write_location() + '.cache/' + namespace,
+                size_limit=int(config.size_limit_mb * 2 ** 20),
+                eviction_policy=config.eviction_policy,
+            )
+            # hits and misses are kept in the cache, across runs
+            cache.stats(enable=True)
+            caches[namespace] = cache
+        return caches[namespace]
+
+
+class LazyCache:
+    """
+    Stands in for the cache of a namespace at module level, the sqlite
+    database is only opened when the cache is first used.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+
+    def __getattr__(self, name):
+        return getattr(get_cache(self.namespace), name)
+
+
+def get_namespace_config(namespace) -> CacheNamespace:
+    default = NAMESPACES[namespace]
+    size_limit_mb = envConf.cache_size_limits().get(namespace,
+                                                    default.size_limit_mb)
+    eviction_policy = envConf.cache_eviction_policies().get(
+        namespace, default.eviction_policy)
+    if eviction_policy not in EVICTION_POLICIES:
+        logger.warning(f"Unknown eviction policy {eviction_policy} for cache "
+                       f"{namespace}, using {default.eviction_policy}")
+        eviction_policy = default.eviction_policy
+    return CacheNamespace(float(size_limit_mb), eviction_policy)
+
+
+def secret_hash(secret):
+    """Stable stand-in for a token in cache keys, the token is not stored."""
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def get_stats(namespace) -> CacheStats:
+    cache = get_cache(namespace)
+    hits, misses = cache.stats()
+    return CacheStats(namespace, len(cache), cache.volume(), cache.size_limit,
+                      cache.eviction_policy, hits, misses)
+
+
+def hit_ratio(stats: CacheStats):
+    lookups = stats.hits + stats.misses
+    return stats.hits / lookups if lookups else None
+
+
+def log_stats():
+    for namespace in NAMESPACES:
+        stats = get_stats(namespace)
+        ratio = hit_ratio(stats)
+        logger.info(f"cache {namespace}: {stats.items} entries, "
+                    f"{stats.size_bytes / 2 ** 20:.1f} of "
+                    f"{stats.size_limit_bytes / 2 ** 20:.1f} MiB "
+                    f"({stats.eviction_policy}), {stats.hits} hits, "
+                    f"{stats.misses} misses, hit ratio "
+                    f"{'-' if ratio is None else f'{ratio:.0%}'}")
+    return True
+
+
+def prune():
+    """Removes expired entries, then evicts until every cache fits its limit."""
+    for namespace in NAMESPACES:
+        cache = get_cache(namespace)
+        expired = cache.expire()
+        evicted = cache.cull()
+        logger.info(f"cache {namespace}: removed {expired} expired and "
+                    f"{evicted} evicted entries")
+    logger.info(f"symbol index: removed {symbol_index.prune()} expired lookups")
+    return True
+
+
+def invalidate(targets):
+    """
+    Drops cached entries, targets as in CACHE_INVALIDATE:
+    accounts, platform, query, symbol:<isin or symbol>, a namespace name or all.
+    """
+    success = True
+    for target in targets:
+        if target == TAG_ACCOUNTS:
+            removed = get_cache("ghostfolio-api").evict(TAG_ACCOUNTS)
+        elif target == TAG_QUERY:
+            removed = get_cache("ibkr-api").evict(TAG_QUERY)
+        elif target == TAG_PLATFORM:
+            removed = get_cache("ghostfolio-api").evict(TAG_PLATFORM)
+        elif target.startswith("symbol:"):
+            removed = int(symbol_index.invalidate(target[len("symbol:"):]))
+        elif target in NAMESPACES:
+            removed = get_cache(target).clear()
+        elif target == "all":
+            removed = sum(get_cache(namespace).clear() for namespace in NAMESPACES)
+        else:
+            logger.error(f"Unknown cache invalidation target {target}")
+            success = False
+            continue
+        logger.info(f"cache invalidate {target}: removed {removed} entries")
+    return success
@@ -0,0 +1,137 @@
+import glob
+import gzip
+import json
+import os
+from datetime import datetime
+
+import LoggerFactory
+from EnvironmentConfiguration import EnvironmentConfiguration
+
+# dumps are named <timestamp>-<name>.<extension>[.gz]
+TIMESTAMP_FORMAT = '%Y-%m-%d_%H:%M:%S'
+TIMESTAMP_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]_" \
+                 "[0-9][0-9]:[0-9][0-9]:[0-9][0-9]"
+
+envConf = EnvironmentConfiguration()
+logger = LoggerFactory.logger
+
+
+class DebugDump:
+    """
+    NDJSON file written record by record, gzip compressed if
+    DEBUG_FILES_COMPRESS is set. Older dumps of the same name are rotated
+    out when it is closed.
+
+    Does nothing unless WRITE_DEBUG_FILES is set, so callers do not need
+    to check the flag themselves.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = None
+        self.records = 0
+        self.__file = None
+
+    def __enter__(self):
+        if envConf.is_debug_files_enabled():
+            self.path = dump_path(self.name, "ndjson")
+            logger.warning(f"WRITE_DEBUG_FILES: writing {self.path}")
+            self.__file = open_dump(self.path, 'wt')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+            rotate(self.name)
+
+    def write(self, record):
+        if self.__file is None:
+            return
+        if hasattr(record, '_asdict'):
+            record = record._asdict()
+        self.__file.write(json.dumps(record, default=str))
+        self.__file.write("\n")
+        self.records += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+
+    def tee(self, records):
+        """Yields records, writing each one as it passes."""
+        for record in records:
+            self.write(record)
+            yield record
+
+
+def write_bytes(name, extension, data: bytes):
+    """Writes data as a single dump file, e.g. the raw flex statement."""
+    if not envConf.is_debug_files_enabled():
+        return
+    path = dump_path(name, extension)
+    logger.warning(f"WRITE_DEBUG_FILES: writing {path}")
+    with open_dump(path, 'wb') as outfile:
+        outfile.write(data)
+    rotate(name)
+
+
+def dump_path(name, extension):
+    timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
+    path = f"{envConf.file_write_location()}{timestamp}-{name}.{extension}"
+    if envConf.is_debug_files_compressed():
+        path += ".gz"
+    return path
+
+
+def open_dump(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def rotate(name):
+    """
+    Keeps the newest DEBUG_FILES_KEEP dumps of name, then removes the oldest
+    dumps of any name while all of them together exceed DEBUG_FILES_MAX_MB.
+    """
+    folder = glob.escape(envConf.file_write_location())
+    same_name = sorted(glob.glob(f"{folder}{TIMESTAMP_GLOB}-{glob.escape(name)}.*"),
+                       key=modified_time, reverse=True)
+    for path in same_name[envConf.debug_files_keep():]:
+        remove(path)
+    max_bytes = envConf.debug_files_max_bytes()
+    if max_bytes <= 0:
+        return
+    dumps = sorted(glob.glob(f"{folder}{TIMESTAMP_GLOB}-*"),
+                   key=modified_time, reverse=True)
+    if not dumps:
+        return
+    # the newest dump is kept even if it exceeds the limit by itself
+    total = file_size(dumps[0])
+    for path in dumps[1:]:
+        total += file_size(path)
+        if total > max_bytes:
+            remove(path)
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def modified_time(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+def remove(path):
+    try:
+        os.remove(path)
+        logger.debug(f"WRITE_DEBUG_FILES: removed {path}")
+    except OSError as e:
+        logger.warning(f"WRITE_DEBUG_FILES: could not remove {path}: {e}")
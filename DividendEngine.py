@@ -0,0 +1,209 @@
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import LoggerFactory
+from GhostfolioApi import GhostfolioImportActivity, GhostfolioTicker
+
+DIVIDEND = "DIVIDEND"
+WITHHOLDING_TAX = "WHTAX"
+# "CASH DIVIDEND USD 0.24 PER SHARE"
+PER_SHARE_PATTERN = re.compile(r"(\d+(?:\.\d+)?) PER SHARE")
+SYNC_COMMENT_PATTERN = re.compile(r"<sync-dividend>(\S+) (\S+)</sync-dividend>")
+# DIVIDEND orders without a sync comment, e.g. from Ghostfolio's dividend
+# import, are dated on the ex-date; without an ex-date in the statement it is
+# assumed to be at most this many days before the pay date
+EX_DATE_WINDOW_DAYS = 45
+# dates stored in UTC may be a day off the local date
+DATE_TOLERANCE = timedelta(days=1)
+# (currency of the cash row, currency of the ticker) -> factor
+MINOR_UNITS = {
+    ("GBP", "GBp"): 100,
+    ("GBP", "GBX"): 100,
+    ("ZAR", "ZAc"): 100,
+    ("ILS", "ILA"): 100,
+}
+
+DividendPayment = namedtuple('DividendPayment',
+                             'isin pay_date ex_date currency gross net per_share')
+Dividends = namedtuple('Dividends', 'activities windows')
+
+logger = LoggerFactory.logger
+
+
+def dividend_id(isin, pay_date):
+    """Sync state key of a dividend, next to the trade transactionIDs."""
+    return f"dividend:{isin}:{pay_date}"
+
+
+def sync_comment(isin, pay_date):
+    return f"<sync-dividend>{isin} {pay_date}</sync-dividend>"
+
+
+def as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def get_pay_date(cash_transaction):
+    if cash_transaction.dateTime is not None:
+        return as_date(cash_transaction.dateTime)
+    return cash_transaction.settleDate or cash_transaction.reportDate
+
+
+def group_payments(cash_transactions) -> list[DividendPayment]:
+    """
+    Sums the dividend, payment in lieu and withholding tax rows of each
+    ISIN and pay date. Corrections are rows with the opposite sign, so they
+    cancel out what they correct.
+    """
+    payments = {}
+    for cash_transaction in cash_transactions:
+        if not cash_transaction.isin:
+            continue
+        key = (cash_transaction.isin, get_pay_date(cash_transaction))
+        isin, pay_date = key
+        payment = payments.get(key) or DividendPayment(
+            isin, pay_date, None, cash_transaction.currency, Decimal(0), Decimal(0),
+            None)
+        amount = Decimal(cash_transaction.amount)
+        gross = payment.gross
+        per_share = payment.per_share
+        ex_date = payment.ex_date
+        if cash_transaction.exDate is not None:
+            row_ex_date = as_date(cash_transaction.exDate)
+            ex_date = min(ex_date or row_ex_date, row_ex_date)
+        if cash_transaction.type.name != WITHHOLDING_TAX:
+            gross += amount
+            match = PER_SHARE_PATTERN.search(cash_transaction.description or "")
+            if match and per_share is None:
+                per_share = Decimal(match.group(1))
+        payments[key] = payment._replace(gross=gross, net=payment.net + amount,
+                                         per_share=per_share, ex_date=ex_date)
+    return sorted(payments.values(), key=lambda x: (x.pay_date, x.isin))
+
+
+def to_activity(account_id, payment: DividendPayment,
+                ticker: GhostfolioTicker) -> GhostfolioImportActivity:
+    """
+    The net payment as a DIVIDEND activity. With a per share amount in the
+    description that gives a whole number of shares, quantity and unit price
+    are per share, as in Ghostfolio's own dividend import, otherwise the
+    quantity is 1 and the unit price the whole payment.
+    """
+    net = payment.net
+    currency = payment.currency
+    factor = MINOR_UNITS.get((currency, ticker.currency))
+    if factor is not None:
+        net *= factor
+        currency = ticker.currency
+    elif currency != ticker.currency:
+        # like trades, imported in the currency paid, Ghostfolio converts it
+        logger.debug(f"dividend of {payment.isin} paid in {currency}, "
+                     f"quoted in {ticker.currency}")
+    quantity = Decimal(1)
+    if payment.per_share:
+        shares = payment.gross / payment.per_share
+        if shares >= 1 and abs(shares - shares.to_integral_value()) < Decimal("0.01"):
+            quantity = shares.to_integral_value()
+    return GhostfolioImportActivity(
+        currency,
+        ticker.data_source,
+        datetime.combine(payment.pay_date, datetime.min.time()).isoformat(),
+        0,
+        float(quantity),
+        ticker.symbol,
+        DIVIDEND,
+        round(float(net / quantity), 6),
+        account_id,
+        sync_comment(payment.isin, payment.pay_date),
+    )
+
+
+def get_window(payment: DividendPayment):
+    """
+    (first, last) date, as yyyy-mm-dd, an order of the payment may be dated
+    on: from the ex-date to the pay date.
+    """
+    ex_date = payment.ex_date or payment.pay_date - timedelta(days=EX_DATE_WINDOW_DAYS)
+    return ((ex_date - DATE_TOLERANCE).isoformat(),
+            (payment.pay_date + DATE_TOLERANCE).isoformat())
+
+
+def build_dividends(account_id, cash_transactions,
+                    tickers: dict[tuple, GhostfolioTicker]) -> Dividends:
+    """
+    Dividend activities from the summary cash transactions of a statement,
+    and the window of dates of each, both by dividend_id. Payments without a
+    ticker or fully withheld or reversed are left out.
+    """
+    dividends = Dividends({}, {})
+    missing_tickers = set()
+    for payment in group_payments(cash_transactions):
+        ticker = tickers.get((payment.isin, None))
+        if ticker is None:
+            missing_tickers.add(payment.isin)
+            continue
+        if payment.net <= 0:
+            logger.debug(f"dividend of {payment.isin} on {payment.pay_date} "
+                         f"nets to {payment.net}, skipping")
+            continue
+        key = dividend_id(payment.isin, payment.pay_date)
+        dividends.activities[key] = to_activity(account_id, payment, ticker)
+        dividends.windows[key] = get_window(payment)
+    if missing_tickers:
+        logger.warning(f"No symbol found for the dividends of "
+                       f"{sorted(missing_tickers)}")
+    return dividends
+
+
+class ExistingDividends:
+    """
+    Collects the DIVIDEND orders of activities passing through collect, to
+    find the dividends of a statement that are not in Ghostfolio yet.
+    """
+
+    def __init__(self):
+        # dividend ids of orders with the sync comment
+        self.synced_ids = set()
+        # symbol -> dates of DIVIDEND orders without it
+        self.other_dates = {}
+
+    def collect(self, activities):
+        for activity in activities:
+            if activity.type == DIVIDEND:
+                self.__add(activity)
+            yield activity
+
+    def __add(self, activity: GhostfolioImportActivity):
+        match = SYNC_COMMENT_PATTERN.search(activity.comment or "")
+        if match:
+            self.synced_ids.add(dividend_id(match.group(1), match.group(2)))
+        else:
+            self.other_dates.setdefault(activity.symbol, []).append(
+                activity.date[0:10])
+
+    def missing(self, activities: dict[str, GhostfolioImportActivity],
+                windows: dict[str, tuple]) -> dict[str, GhostfolioImportActivity]:
+        """
+        The activities, by dividend_id, not in Ghostfolio. An activity is in
+        Ghostfolio if an order carries its sync comment, or else if an order
+        of the same symbol without one is dated within its window. Each such
+        order stands for one dividend only, the earliest it can.
+        """
+        other_dates = {symbol: sorted(dates)
+                       for symbol, dates in self.other_dates.items()}
+        missing = {}
+        # by end of window, so earlier payments take the earlier orders
+        for key in sorted(activities, key=lambda x: windows[x][1]):
+            if key in self.synced_ids:
+                continue
+            activity = activities[key]
+            first, last = windows[key]
+            dates = other_dates.get(activity.symbol, [])
+            match = next((date for date in dates if first <= date <= last), None)
+            if match is None:
+                missing[key] = activity
+            else:
+                dates.remove(match)
+        return missing
@@ -1,8 +1,58 @@
 import os
+from datetime import timedelta
 
 log_level = os.environ.get("LOG_LEVEL", "INFO")
 write_debug_files = os.environ.get("WRITE_DEBUG_FILES", "FALSE")
+debug_files_compress = os.environ.get("DEBUG_FILES_COMPRESS", "FALSE")
+debug_files_keep = os.environ.get("DEBUG_FILES_KEEP", "5")
+debug_files_max_mb = os.environ.get("DEBUG_FILES_MAX_MB", "200")
 write_files_location = os.environ.get("FILE_WRITE_LOCATION", "")
+ibkr_flex_url = os.environ.get("IBKR_FLEX_URL", "")
+ghost_pool_size = os.environ.get("GHOST_POOL_SIZE", "10")
+ghost_timeout = os.environ.get("GHOST_TIMEOUT", "30")
+ghost_page_size = os.environ.get("GHOST_PAGE_SIZE", "500")
+ghost_rate_limit = os.environ.get("GHOST_RATE_LIMIT", "20")
+retry_max_attempts = os.environ.get("RETRY_MAX_ATTEMPTS", "4")
+retry_base_delay = os.environ.get("RETRY_BASE_DELAY", "0.5")
+retry_max_delay = os.environ.get("RETRY_MAX_DELAY", "30")
+circuit_breaker_threshold = os.environ.get("CIRCUIT_BREAKER_THRESHOLD", "5")
+circuit_breaker_reset = os.environ.get("CIRCUIT_BREAKER_RESET", "60")
+lookup_concurrency = os.environ.get("LOOKUP_CONCURRENCY", "4")
+delete_concurrency = os.environ.get("DELETE_CONCURRENCY", "8")
+import_chunk_size = os.environ.get("IMPORT_CHUNK_SIZE", "10")
+import_max_chunk_size = os.environ.get("IMPORT_MAX_CHUNK_SIZE", "200")
+import_concurrency = os.environ.get("IMPORT_CONCURRENCY", "1")
+flex_stream_parse = os.environ.get("FLEX_STREAM_PARSE", "FALSE")
+sync_pipeline = os.environ.get("SYNC_PIPELINE", "TRUE")
+full_reconcile_every = os.environ.get("FULL_RECONCILE_EVERY", "24")
+symbol_index_file = os.environ.get("SYMBOL_INDEX_FILE", "")
+symbol_index_ttl_days = os.environ.get("SYMBOL_INDEX_TTL_DAYS", "30")
+symbol_index_negative_ttl_hours = os.environ.get("SYMBOL_INDEX_NEGATIVE_TTL_HOURS",
+                                                 "24")
+sync_interval_minutes = os.environ.get("SYNC_INTERVAL", "60")
+sync_jitter_seconds = os.environ.get("SYNC_JITTER", "30")
+run_report_file = os.environ.get("RUN_REPORT_FILE", "")
+prometheus_textfile = os.environ.get("PROMETHEUS_TEXTFILE", "")
+health_file = os.environ.get("HEALTH_FILE", "")
+healthcheck_url = os.environ.get("HEALTHCHECK_URL", "")
+sync_plan_location = os.environ.get("SYNC_PLAN_LOCATION", "")
+cache_size_limits = os.environ.get("CACHE_SIZE_LIMITS", "")
+cache_eviction_policies = os.environ.get("CACHE_EVICTION_POLICIES", "")
+cache_invalidate = os.environ.get("CACHE_INVALIDATE", "")
+
+
+def is_true(value):
+    return value.strip().upper() in ("TRUE", "1", "YES", "ON")
+
+
+def parse_mapping(value):
+    """"a=1,b=2" -> {"a": "1", "b": "2"}"""
+    mapping = {}
+    for item in value.split(","):
+        if "=" in item:
+            key, item_value = item.split("=", 1)
+            mapping[key.strip()] = item_value.strip()
+    return mapping
 
 
 class EnvironmentConfiguration:
@@ -11,7 +61,17 @@ class EnvironmentConfiguration:
         pass
 
     def is_debug_files_enabled(self):
-        return write_debug_files
+        return is_true(write_debug_files)
+
+    def is_debug_files_compressed(self):
+        return is_true(debug_files_compress)
+
+    def debug_files_keep(self):
+        """Dumps kept per name, e.g. per account for the activity dumps."""
+        return max(1, int(debug_files_keep))
+
+    def debug_files_max_bytes(self):
+        return int(float(debug_files_max_mb) * 2 ** 20)
 
     def file_write_location(self):
         if len(write_files_location) > 0:
@@ -20,3 +80,110 @@ class EnvironmentConfiguration:
 
     def log_level(self):
         return log_level
+
+    def ibkr_flex_url(self):
+        """Flex Web Service SendRequest url, None for the ibflex default."""
+        return ibkr_flex_url or None
+
+    def ghost_pool_size(self):
+        return int(ghost_pool_size)
+
+    def ghost_timeout(self):
+        return float(ghost_timeout)
+
+    def ghost_page_size(self):
+        return max(1, int(ghost_page_size))
+
+    def ghost_rate_limit(self):
+        return float(ghost_rate_limit)
+
+    def retry_max_attempts(self):
+        return max(1, int(retry_max_attempts))
+
+    def retry_base_delay(self):
+        return float(retry_base_delay)
+
+    def retry_max_delay(self):
+        return float(retry_max_delay)
+
+    def circuit_breaker_threshold(self):
+        return int(circuit_breaker_threshold)
+
+    def circuit_breaker_reset(self):
+        return float(circuit_breaker_reset)
+
+    def lookup_concurrency(self):
+        return max(1, int(lookup_concurrency))
+
+    def delete_concurrency(self):
+        return max(1, int(delete_concurrency))
+
+    def import_chunk_size(self):
+        return max(1, int(import_chunk_size))
+
+    def import_max_chunk_size(self):
+        return max(1, int(import_max_chunk_size))
+
+    def import_concurrency(self):
+        return max(1, int(import_concurrency))
+
+    def full_reconcile_every(self):
+        return max(1, int(full_reconcile_every))
+
+    def symbol_index_file(self):
+        if len(symbol_index_file) > 0:
+            return symbol_index_file
+        return self.file_write_location() + "symbol-index.json"
+
+    def symbol_index_ttl(self):
+        return timedelta(days=float(symbol_index_ttl_days))
+
+    def symbol_index_negative_ttl(self):
+        return timedelta(hours=float(symbol_index_negative_ttl_hours))
+
+    def is_flex_stream_parse_enabled(self):
+        return is_true(flex_stream_parse)
+
+    def is_sync_pipeline_enabled(self):
+        return is_true(sync_pipeline)
+
+    def sync_interval(self):
+        """Seconds between the starts of two daemon syncs."""
+        return max(1.0, float(sync_interval_minutes) * 60)
+
+    def sync_jitter(self):
+        return max(0.0, float(sync_jitter_seconds))
+
+    def health_file(self):
+        if len(health_file) > 0:
+            return health_file
+        return os.path.join(os.path.expanduser("~"), "ghost.health")
+
+    def healthcheck_url(self):
+        return healthcheck_url
+
+    def run_report_file(self):
+        if len(run_report_file) > 0:
+            return run_report_file
+        return self.file_write_location() + "run-report.json"
+
+    def prometheus_textfile(self):
+        return prometheus_textfile
+
+    def sync_plan_file(self, query):
+        """Plan file of OPERATION=PLAN and APPLYPLAN for one flex query."""
+        if len(sync_plan_location) > 0:
+            return os.path.join(sync_plan_location, f"sync-plan-{query}.json")
+        return self.file_write_location() + f"sync-plan-{query}.json"
+
+    def cache_size_limits(self):
+        """Size limit in MiB per cache namespace, for the ones configured."""
+        return {namespace: float(limit)
+                for namespace, limit in parse_mapping(cache_size_limits).items()}
+
+    def cache_eviction_policies(self):
+        return parse_mapping(cache_eviction_policies)
+
+    def cache_invalidate(self):
+        return [target.strip() for target in cache_invalidate.split(",")
+                if target.strip()]
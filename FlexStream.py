@@ -0,0 +1,164 @@
+import datetime
+import decimal
+import enum
+import io
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+from ibflex import CashAction, CashReportCurrency, CashTransaction, Trade, parser
+
+import LoggerFactory
+
+# same attribute names as ibflex FlexQueryResponse/FlexStatement, so the
+# IbkrApi helpers work on either
+FlexQueryExtract = namedtuple('FlexQueryExtract', 'FlexStatements')
+FlexStatementExtract = namedtuple('FlexStatementExtract',
+                                  'accountId Trades CashTransactions CashReport')
+
+# bump when the columns change, cached extracts of other versions are ignored
+EXTRACT_VERSION = 2
+EXTRACT_COLUMNS = {
+    "Trades": (Trade, (
+        "transactionID", "accountId", "assetCategory", "symbol", "isin",
+        "currency", "tradeDate", "buySell", "openCloseIndicator", "quantity",
+        "tradePrice", "taxes", "ibCommission", "ibCommissionCurrency")),
+    "CashTransactions": (CashTransaction, (
+        "transactionID", "accountId", "type", "assetCategory", "symbol", "isin",
+        "currency", "fxRateToBase", "description", "dateTime", "settleDate",
+        "reportDate", "exDate", "amount", "levelOfDetail")),
+    "CashReport": (CashReportCurrency, (
+        "accountId", "currency", "endingCash", "endingCashPaxos")),
+}
+
+STOCK_ASSET_CATEGORY = "STK"
+CASH_TRANSACTION_TYPES = {CashAction.DIVIDEND.value,
+                          CashAction.PAYMENTINLIEU.value,
+                          CashAction.WHTAX.value}
+
+logger = LoggerFactory.logger
+
+
+def parse_stream(source) -> FlexQueryExtract:
+    """
+    Parses a Flex statement incrementally, keeping only what the sync uses:
+    stock trades, summary dividend/withholding cash transactions and the
+    first cash report row of each statement. Every other element is dropped
+    as soon as it has been read, so memory does not grow with the statement.
+
+    Args:
+        source: file name, file object, or bytes (as returned by the client).
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    statements = []
+    skipped_trades = {}
+    trades = cash_transactions = cash_report = None
+    account_id = None
+    # open elements, data elements are removed from their parent once read
+    path = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if not path and elem.tag != "FlexQueryResponse":
+                raise parser.FlexParserError("Not a FlexQueryResponse")
+            if elem.tag == "FlexStatement":
+                account_id = elem.get("accountId")
+                trades, cash_transactions, cash_report = [], [], []
+            path.append(elem)
+            continue
+        path.pop()
+        if elem.tag == "Trade":
+            category = elem.get("assetCategory")
+            if category == STOCK_ASSET_CATEGORY:
+                trades.append(parser.parse_data_element(elem))
+            else:
+                skipped_trades[category] = skipped_trades.get(category, 0) + 1
+        elif elem.tag == "CashTransaction":
+            if elem.get("levelOfDetail") == "SUMMARY" \
+                    and elem.get("type") in CASH_TRANSACTION_TYPES:
+                cash_transactions.append(parser.parse_data_element(elem))
+        elif elem.tag == "CashReportCurrency":
+            if not cash_report:
+                cash_report.append(parser.parse_data_element(elem))
+        elif elem.tag == "FlexStatement":
+            statements.append(FlexStatementExtract(
+                account_id,
+                tuple(trades),
+                tuple(cash_transactions),
+                tuple(cash_report),
+            ))
+        if path:
+            elem.clear()
+            del path[-1][-1]
+    if skipped_trades:
+        logger.info(f"Skipped while streaming: {skipped_trades}")
+    return FlexQueryExtract(tuple(statements))
+
+
+def to_columns(query) -> dict:
+    """
+    Compact, ibflex version independent form of an extract: per statement one
+    list per column, values in Flex notation, so from_columns can convert
+    them back with the ibflex attribute converters.
+    """
+    statements = []
+    for statement in extract_statements(query):
+        columns = {"accountId": statement.accountId}
+        for name, (_, fields) in EXTRACT_COLUMNS.items():
+            rows = getattr(statement, name)
+            columns[name] = {field: [to_flex_value(getattr(row, field))
+                                     for row in rows]
+                             for field in fields}
+            columns[name]["count"] = len(rows)
+        statements.append(columns)
+    return {"version": EXTRACT_VERSION, "FlexStatements": statements}
+
+
+def from_columns(columns: dict) -> FlexQueryExtract:
+    statements = []
+    for statement in columns["FlexStatements"]:
+        rows = {}
+        for name, (element_class, fields) in EXTRACT_COLUMNS.items():
+            values = statement[name]
+            rows[name] = tuple(
+                element_class(**dict(
+                    parser.parse_element_attr(element_class, field, value)
+                    for field, value in ((field, values[field][i])
+                                         for field in fields)
+                    if value is not None))
+                for i in range(values["count"]))
+        statements.append(FlexStatementExtract(
+            statement["accountId"],
+            rows["Trades"],
+            rows["CashTransactions"],
+            rows["CashReport"],
+        ))
+    return FlexQueryExtract(tuple(statements))
+
+
+def extract_statements(query) -> list[FlexStatementExtract]:
+    """Applies the parse_stream filters to a fully parsed FlexQueryResponse."""
+    if isinstance(query, FlexQueryExtract):
+        return list(query.FlexStatements)
+    return [FlexStatementExtract(
+        statement.accountId,
+        tuple(trade for trade in statement.Trades
+              if trade.assetCategory is not None
+              and trade.assetCategory.value == STOCK_ASSET_CATEGORY),
+        tuple(cash_transaction for cash_transaction in statement.CashTransactions
+              if cash_transaction.levelOfDetail == "SUMMARY"
+              and cash_transaction.type is not None
+              and cash_transaction.type.value in CASH_TRANSACTION_TYPES),
+        tuple(statement.CashReport[:1]),
+    ) for statement in query.FlexStatements]
+
+
+def to_flex_value(value):
+    if value is None:
+        return None
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return str(value)
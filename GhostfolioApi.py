@@ -1,28 +1,153 @@
+import contextvars
 import json
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
 
-import requests
 import sys
+import threading
+import time
 
-from diskcache import Cache
+from requests import Timeout
 
+import CacheManager
 import LoggerFactory
+import RunMetrics
+import SymbolResolver
 from EnvironmentConfiguration import EnvironmentConfiguration
+from HttpClient import HttpClient, JSON_HEADERS
+from SymbolIndex import symbol_index
 
-SymbolLookupOverride = namedtuple('SymbolLookupOverride',
-                                  'exists data_source symbol currency')
 GhostfolioConfig = namedtuple('GhostfolioConfig',
                               'token host currency account_name, '
                               'platform_id platform_name')
 GhostfolioTicker = namedtuple('GhostfolioTicker',
                               'data_source, symbol, currency')
-GhostfolioImportActivity = namedtuple('GhostfolioImportActivity',
-                                      'currency, dataSource, date, fee, quantity, '
-                                      'symbol, type, unitPrice, accountId, comment')
+
+
+class GhostfolioImportActivity:
+    """
+    An activity as imported into Ghostfolio.
+
+    Same fields and positional order as the former namedtuple, without a
+    per-instance dict. Repeated strings (dates, symbols, currencies) are
+    interned and the fee is a float. The hash of the identity used by the
+    diff is computed once, the identity itself only when hashes collide.
+    id is the Ghostfolio order id, None for activities not yet in Ghostfolio.
+    """
+    __slots__ = ('currency', 'dataSource', 'date', 'fee', 'quantity', 'symbol',
+                 'type', 'unitPrice', 'accountId', 'comment', 'id', 'key_hash')
+    _fields = __slots__[:-1]
+
+    def __init__(self, currency, dataSource, date, fee, quantity, symbol, type,
+                 unitPrice, accountId, comment, id=None):
+        self.currency = intern_str(currency)
+        self.dataSource = intern_str(dataSource)
+        self.date = intern_str(date)
+        self.fee = float(fee)
+        self.quantity = quantity
+        self.symbol = intern_str(symbol)
+        self.type = intern_str(type)
+        self.unitPrice = unitPrice
+        self.accountId = intern_str(accountId)
+        self.comment = comment
+        self.id = id
+        self.key_hash = hash(self.key())
+
+    def key(self):
+        """
+        Identity of the activity apart from its comment, as compared by
+        ActivityDiff.format_act: dates without milliseconds and time zone.
+        """
+        return (self.accountId, self.date[0:18], self.fee, self.quantity,
+                self.symbol, self.type, self.unitPrice)
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+    def _replace(self, **changes):
+        values = self._asdict()
+        values.update(changes)
+        return GhostfolioImportActivity(**values)
+
+    def to_import_dict(self):
+        """The activity as sent to the import endpoint, which rejects an id."""
+        return {
+            "currency": self.currency,
+            "dataSource": self.dataSource,
+            "date": self.date,
+            "fee": self.fee,
+            "quantity": self.quantity,
+            "symbol": self.symbol,
+            "type": self.type,
+            "unitPrice": self.unitPrice,
+            "accountId": self.accountId,
+            "comment": self.comment,
+        }
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self._fields)
+
+    def __eq__(self, other):
+        if not isinstance(other, GhostfolioImportActivity):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "GhostfolioImportActivity(" + ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self._fields) + ")"
+
+
+def intern_str(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def account_changes(current, account):
+    """
+    Fields of account that differ from current, the account as last known
+    from the server. Balances are compared in cents.
+    """
+    changes = []
+    for field, value in account.items():
+        known = current.get(field)
+        if field == "balance" and known is not None and value is not None:
+            if round(float(known), 2) == round(float(value), 2):
+                continue
+        elif known == value:
+            continue
+        changes.append(field)
+    return changes
+
+
+RejectedActivity = namedtuple('RejectedActivity', 'activity reason')
+
+
+class ImportResult(namedtuple('ImportResult',
+                              'imported rejected retried not_imported')):
+    """
+    Activities imported, rejected by the server, sent more than once, and
+    not imported because the import stopped on an error not caused by them.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return len(self.rejected) == 0 and len(self.not_imported) == 0
+
 
 DATA_SOURCE_YAHOO = "YAHOO"
-cache = Cache(
-    directory=EnvironmentConfiguration().file_write_location() + '.cache/ghostfolio-api')
+# status of an import chunk that timed out
+IMPORT_TIMEOUT = "timeout"
+# statuses of a chunk the server refused for its content, split to find
+# the activities at fault; any other failure (auth, server, connection)
+# stops the import, sending the activities one by one would fail the same
+IMPORT_SPLIT_STATUSES = (400, 413, 422, IMPORT_TIMEOUT)
+envConf = EnvironmentConfiguration()
+cache = CacheManager.LazyCache("ghostfolio-api")
+ACCOUNTS_CACHE_EXPIRE = 600
+PLATFORM_CACHE_EXPIRE = 30 * 24 * 3600
 logger = LoggerFactory.logger
 
 
@@ -35,40 +160,104 @@ class GhostfolioApi:
         self.ghost_account_sync_name = config.account_name
         self.ibkr_platform_name = config.platform_name
         self.account_name = config.account_name
-        # todo should not do magic in ctor...
-        if config.platform_id is None:
-            self.ibkr_platform_id = self.__get_ibkr_platform_id()
-        else:
-            self.ibkr_platform_id = config.platform_id
-
-    def update_account(self, account_id, account):
-        url = f"{self.ghost_host}/api/v1/account/{account_id}"
+        # the RunMetrics run the presenter view was last checked in
+        self.__presenter_view_checked_run = None
+        self.__presenter_view_checked = False
+        self.__platform_id = config.platform_id
+        # created on first use, runs without requests do not pay for them
+        self.__client = None
+        self.__lazy_lock = threading.RLock()
+
+    @property
+    def client(self) -> HttpClient:
+        if self.__client is None:
+            with self.__lazy_lock:
+                if self.__client is None:
+                    self.__client = HttpClient(
+                        self.ghost_host,
+                        self.__get_header_with_ghostfolio_auth(),
+                        pool_size=envConf.ghost_pool_size(),
+                        timeout=envConf.ghost_timeout(),
+                    )
+        return self.__client
+
+    @property
+    def ibkr_platform_id(self):
+        """
+        Looked up by name when first needed, and kept in the cache across
+        runs since platform ids do not change.
+        """
+        if self.__platform_id is None:
+            with self.__lazy_lock:
+                if self.__platform_id is None:
+                    self.__platform_id = self.__get_cached_ibkr_platform_id()
+        return self.__platform_id
+
+    def __get_cached_ibkr_platform_id(self):
+        key = ("platform", self.ghost_host, self.ibkr_platform_name)
+        platform_id = cache.get(key)
+        if platform_id is not None:
+            return platform_id
+        platform_id = self.__get_ibkr_platform_id()
+        if platform_id is not None:
+            cache.set(key, platform_id, expire=PLATFORM_CACHE_EXPIRE,
+                      tag=CacheManager.TAG_PLATFORM)
+        return platform_id
+
+    def update_account(self, account_id, account, current=None):
+        """
+        PUTs account, unless current, the account as last known from the
+        server, already has the same values. Returns True if the account
+        holds the values of account afterwards.
+        """
+        if current is not None:
+            changes = account_changes(current, account)
+            if not changes:
+                logger.info(f"Account {account_id} unchanged, not updating")
+                RunMetrics.count("writes_skipped")
+                return True
+            logger.info(f"Account {account_id} changed: {', '.join(changes)}")
+        path = f"api/v1/account/{account_id}"
+        url = f"{self.ghost_host}/{path}"
 
-        payload = json.dumps(account)
-        headers = {
-            'Authorization': f"Bearer {self.ghost_token}",
-            'Content-Type': 'application/json'
-        }
         try:
             self.__log_request(url, account)
-            response = requests.request("PUT", url, headers=headers, data=payload)
+            response = self.client.put(path, "api/v1/account/{id}", json=account)
         except Exception as e:
             self.__log_request_error(url, f"{e}")
             return False
         if response.status_code == 200:
             self.__log_request(url, f"Updated Cash for account {response.json()['id']}")
+            RunMetrics.count("writes")
+            self.__remember_account(account_id, account)
         else:
             self.__log_request_error(url, f"Failed create: {response.text}")
         return response.status_code == 200
 
+    def __remember_account(self, account_id, account):
+        """
+        Applies a successful update to the cached accounts, so the next run
+        compares against what was written. The entry keeps its expiry, a
+        change made in Ghostfolio itself is seen after ACCOUNTS_CACHE_EXPIRE.
+        """
+        key = self.__accounts_cache_key()
+        accounts, expire_time = cache.get(key, expire_time=True)
+        if not accounts or expire_time is None:
+            return
+        remaining = expire_time - time.time()
+        if remaining <= 0:
+            return
+        accounts = [{**known, **account} if known.get("id") == account_id else known
+                    for known in accounts]
+        cache.set(key, accounts, expire=remaining, tag=CacheManager.TAG_ACCOUNTS)
+
     def delete_activity(self, act_id):
-        url = f"{self.ghost_host}/api/v1/order/{act_id}"
+        path = f"api/v1/order/{act_id}"
+        url = f"{self.ghost_host}/{path}"
 
-        payload = {}
-        headers = self.__get_header_with_ghostfolio_auth()
         try:
             self.__log_request(url)
-            response = requests.request("DELETE", url, headers=headers, data=payload)
+            response = self.client.delete(path, "api/v1/order/{id}")
         except Exception as e:
             self.__log_request_error(url, e.__str__())
             return False
@@ -85,17 +274,16 @@ class GhostfolioApi:
                             response.request.url,
                             items)
             if len(items) >= 1:
-                return True, items[0]
-            return False, None
+                return True, items[0], items[1:]
+            return False, None, []
         else:
             raise Exception(response)
 
     def get_presenter_view_activated(self) -> bool:
         url = f"{self.ghost_host}/api/v1/user"
-        headers = self.__get_header_with_ghostfolio_auth()
         try:
             self.__log_request(url)
-            response = requests.request("GET", url, headers=headers)
+            response = self.client.get("api/v1/user")
             ghostfolio_account_settings = response.json()['settings']
             return 'isRestrictedView' in ghostfolio_account_settings
         except Exception as e:
@@ -107,13 +295,10 @@ class GhostfolioApi:
     def set_presenterview(self, enabled):
         url = f"{self.ghost_host}/api/v1/user/setting"
 
-        payload = '{"isRestrictedView":'
-        payload += "true" if enabled else "false"
-        payload += ' }'
-        headers = self.__get_header_with_ghostfolio_auth()
+        payload = {"isRestrictedView": bool(enabled)}
         try:
             self.__log_request(url)
-            response = requests.put(url, headers=headers, data=payload)
+            response = self.client.put("api/v1/user/setting", json=payload)
             return response.status_code == 200
         except Exception as e:
             logger.warning(
@@ -122,86 +307,182 @@ class GhostfolioApi:
             return False
 
     def get_all_activities(self) -> list[GhostfolioImportActivity]:
+        return list(self.iter_activities())
+
+    def ensure_presenter_view_inactive(self):
+        # checked once per run, not on every fetch; the daemon keeps this
+        # instance across runs, the user may turn presenter view on between
+        run = RunMetrics.current_run.get()
+        if self.__presenter_view_checked and self.__presenter_view_checked_run is run:
+            return
         presenter_view_initial_active = self.get_presenter_view_activated()
         if presenter_view_initial_active:
             logger.warning("presenterview active, not syncing")
             raise AssertionError("Presenterview is active, not syncing. "
                                  "Please deactivate Presenterview!")
-
+        self.__presenter_view_checked_run = run
+        self.__presenter_view_checked = True
+
+    def iter_activities(self, account_id=None) -> Iterator[GhostfolioImportActivity]:
+        """
+        Yields the activities page by page, filtered to account_id if given.
+        Servers without pagination answer the first request with everything.
+        Raises if a page, the first one included, cannot be fetched.
+        """
+        self.ensure_presenter_view_inactive()
         url = f"{self.ghost_host}/api/v1/order"
-
-        payload = {}
-        headers = self.__get_header_with_ghostfolio_auth()
+        page_size = envConf.ghost_page_size()
+        params = {"take": page_size}
+        if account_id is not None:
+            params["accounts"] = account_id
+        skip = 0
+        first_id_of_page = None
+        while True:
+            params["skip"] = skip
+            try:
+                self.__log_request(url, f"skip {skip}")
+                response = self.client.get("api/v1/order", params=params)
+            except Exception as e:
+                logger.warning(
+                    f"get_all_activities {url} error while fetching all activities: {e}"
+                )
+                response = None
+            if response is None or response.status_code != 200:
+                # a partial or empty list would import the missing activities
+                # again, so the caller has to stop instead of diffing against it
+                raise Exception(f"fetching activities failed after {skip}: {response}")
+            content = response.json()
+            activities = content['activities']
+            self.__log_request(url, f"received {len(activities)} activities")
+            if activities and activities[0].get('id') == first_id_of_page:
+                logger.warning(f"{url} ignores skip, stopping after {skip} activities")
+                return
+            for activity in activities:
+                # the account filter is not supported by every version
+                if account_id is None or activity['accountId'] == account_id:
+                    yield self.map_activity_to_import_activity(activity)
+            count = content.get('count')
+            skip += len(activities)
+            if count is None or len(activities) == 0 or skip >= count:
+                return
+            first_id_of_page = activities[0].get('id')
+
+    def import_activities(self, bulk: list[GhostfolioImportActivity]) -> ImportResult:
+        """
+        Imports in chunks, several at a time (IMPORT_CONCURRENCY).
+
+        The chunk size starts at IMPORT_CHUNK_SIZE and doubles after every
+        round the server accepted, up to IMPORT_MAX_CHUNK_SIZE. A chunk that
+        is too large or times out halves the chunk size, a chunk that is
+        too large, times out or is refused (400, 422) is split and sent again
+        until the activities the server rejects are isolated. Any other
+        failure stops the import, what was not imported yet is reported as
+        not_imported.
+        """
+        chunk_size = envConf.import_chunk_size()
+        max_chunk_size = max(chunk_size, envConf.import_max_chunk_size())
+        concurrency = envConf.import_concurrency()
+        remaining = deque(sorted(bulk, key=lambda x: x.date))
+        # halves of failed chunks, sent before new chunks are cut
+        retry_chunks = deque()
+        imported = []
+        rejected = []
+        retried = []
+        not_imported = []
+        # a split chunk is split again, its activities are counted only once
+        retried_ids = set()
+        with ThreadPoolExecutor(max_workers=concurrency,
+                                thread_name_prefix="import") as executor:
+            while remaining or retry_chunks:
+                chunks = []
+                while len(chunks) < concurrency and (remaining or retry_chunks):
+                    if retry_chunks:
+                        chunks.append(retry_chunks.popleft())
+                    else:
+                        chunks.append([remaining.popleft()
+                                       for _ in range(min(chunk_size,
+                                                          len(remaining)))])
+                futures = [executor.submit(contextvars.copy_context().run,
+                                           self.__post_import_chunk,
+                                           chunk)
+                           for chunk in chunks]
+                all_accepted = True
+                for chunk, future in zip(chunks, futures):
+                    status, message = future.result()
+                    if status == 201:
+                        imported.extend(chunk)
+                        continue
+                    all_accepted = False
+                    if status not in IMPORT_SPLIT_STATUSES:
+                        not_imported.extend(chunk)
+                        continue
+                    if status in (413, IMPORT_TIMEOUT):
+                        chunk_size = max(1, min(chunk_size, len(chunk)) // 2)
+                    if len(chunk) == 1:
+                        rejected.append(RejectedActivity(chunk[0], message))
+                        continue
+                    for activity in chunk:
+                        if id(activity) not in retried_ids:
+                            retried_ids.add(id(activity))
+                            retried.append(activity)
+                    middle = len(chunk) // 2
+                    retry_chunks.extend((chunk[:middle], chunk[middle:]))
+                if not_imported:
+                    logger.error(f"import_activities stopped after "
+                                 f"{len(imported)} activities")
+                    not_imported.extend(activity for chunk in retry_chunks
+                                        for activity in chunk)
+                    not_imported.extend(remaining)
+                    break
+                if all_accepted and not retry_chunks:
+                    chunk_size = min(max_chunk_size, chunk_size * 2)
+        result = ImportResult(imported, rejected, retried, not_imported)
+        logger.info(f"import_activities: {len(imported)} imported, "
+                    f"{len(rejected)} rejected, {len(retried)} retried, "
+                    f"{len(not_imported)} not imported")
+        for rejected_activity in rejected:
+            logger.error(f"import_activities rejected "
+                         f"{rejected_activity.activity}: {rejected_activity.reason}")
+        return result
+
+    def __post_import_chunk(self, acts: list[GhostfolioImportActivity]):
+        url = f"{self.ghost_host}/api/v1/import"
+        acts_as_dicts = [act.to_import_dict() for act in acts]
+        formatted_acts = json.dumps(
+            {"activities": acts_as_dicts}
+        )
+        payload = formatted_acts
+        logger.debug("import_activities Adding activities: \n" + formatted_acts)
         try:
-            self.__log_request(url)
-            response = requests.request("GET", url, headers=headers, data=payload)
+            self.__log_request(url, f"adding {len(acts_as_dicts)} activities")
+            response = self.client.post("api/v1/import",
+                                        headers=JSON_HEADERS,
+                                        data=payload)
+        except Timeout as e:
+            self.__log_request_error(url, f"{len(acts)} activities timed out: {e}")
+            return IMPORT_TIMEOUT, f"{e}"
         except Exception as e:
-            logger.warning(
-                f"get_all_activities {url} error while fetching all activities: {e}"
+            self.__log_request_error(
+                url,
+                f"with payload: {payload} failed with {e}"
             )
-            return []
-
-        if response.status_code == 200:
-            activities = response.json()['activities']
-            self.__log_request(url, f"received {len(activities)} activities")
-            import_activities_mapped: list[GhostfolioImportActivity] = []
-            for activity in activities:
-                import_activities_mapped.append(
-                    self.map_activity_to_import_activity(activity))
-            return import_activities_mapped
-        else:
-            return []
-
-    def import_activities(self, bulk: list[GhostfolioImportActivity]):
-        chunks = self.__generate_chunks(bulk, 10)
-        for acts in chunks:
-            url = f"{self.ghost_host}/api/v1/import"
-            sorted_acts: list[GhostfolioImportActivity] \
-                = sorted(acts, key=lambda x: x.date)
-            acts_as_dicts = []
-            for act in sorted_acts:
-                acts_as_dicts.append(act._asdict())
-            formatted_acts = json.dumps(
-                {"activities": acts_as_dicts}
+            return None, f"{e}"
+        if response.status_code == 201:
+            logger.info(
+                f"import_activities {url} created {len(acts_as_dicts)} activities"
             )
-            payload = formatted_acts
-            headers = {
-                'Authorization': f"Bearer {self.ghost_token}",
-                'Content-Type': 'application/json'
-            }
-            logger.debug("import_activities Adding activities: \n" + formatted_acts)
-            try:
-                self.__log_request(url, f"adding {len(acts_as_dicts)} activities")
-                response = requests.request("POST", url, headers=headers, data=payload)
-            except Exception as e:
-                self.__log_request_error(
-                    url,
-                    f"with payload: {payload} failed with {e}"
-                )
-                return False
-            if response.status_code == 201:
-                logger.info(
-                    f"import_activities {url} created {len(acts_as_dicts)} activities"
-                )
-            else:
-                message = f"Failed create following activities:" \
-                          f" {acts_as_dicts}: {response.text}"
-                self.__log_request_error(url, message)
-            if response.status_code != 201:
-                return False
-        return True
+        else:
+            message = f"Failed create following activities:" \
+                      f" {acts_as_dicts}: {response.text}"
+            self.__log_request_error(url, message)
+        return response.status_code, response.text
 
     def add_activity(self, act):
         url = f"{self.ghost_host}/api/v1/order"
 
-        payload = json.dumps(act)
-        headers = {
-            'Authorization': f"Bearer {self.ghost_token}",
-            'Content-Type': 'application/json'
-        }
         logger.info("Adding activity: " + json.dumps(act))
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self.client.post("api/v1/order", json=act)
         except Exception as e:
             logger.error(e)
             return False
@@ -212,11 +493,24 @@ class GhostfolioApi:
         return response.status_code == 201
 
     def create_or_get_ibkr_account(self):
-        accounts = self.get_ghostfolio_accounts()
-        for account in accounts:
+        account = self.get_ibkr_account()
+        if account is not None:
+            return account
+        return self.__create_ibkr_account()
+
+    def get_ibkr_account(self):
+        """The account synced to, None if it was not created yet."""
+        for account in self.get_ghostfolio_accounts():
             if account["name"] == self.ghost_account_sync_name:
                 return account
-        return self.__create_ibkr_account()
+        return None
+
+    def get_account(self, account_id):
+        """The account as last known from the server, None if not found."""
+        for account in self.get_ghostfolio_accounts():
+            if account["id"] == account_id:
+                return account
+        return None
 
     def __create_ibkr_account(self):
         account = {
@@ -227,7 +521,8 @@ class GhostfolioApi:
             "name": self.ghost_account_sync_name,
             "platformId": self.ibkr_platform_id,
         }
-        return self.create_account(account)
+        # create_account returns the id, "" if it failed
+        return {**account, "id": self.create_account(account)}
 
     def delete_all_activities(self, account_id):
         acts: list[GhostfolioImportActivity] = self.get_all_activities_for_account(
@@ -237,28 +532,37 @@ class GhostfolioApi:
         if not acts:
             logger.info("No activities to delete")
             return True
-        complete = True
-
-        for act in acts:
-            if act.accountId == account_id:
-                act_complete = self.delete_activity(act.accountId)
-                complete = complete and act_complete
-                if act_complete:
-                    logger.info("Deleted: %s", act.accountId)
+        acts = [act for act in acts if act.accountId == account_id]
+        total = len(acts)
+        progress_step = max(1, total // 10)
+        deleted = 0
+        failed = 0
+        logger.info(f"Deleting {total} activities, "
+                    f"{envConf.delete_concurrency()} at a time")
+        with ThreadPoolExecutor(max_workers=envConf.delete_concurrency(),
+                                thread_name_prefix="delete") as executor:
+            futures = {executor.submit(contextvars.copy_context().run,
+                                       self.delete_activity,
+                                       act.id): act
+                       for act in acts}
+            for done, future in enumerate(as_completed(futures), start=1):
+                act = futures[future]
+                if future.result():
+                    deleted += 1
+                    logger.debug("Deleted: %s", act.id)
                 else:
-                    logger.warning("Failed Delete: %s", act.accountId)
-        return complete
+                    failed += 1
+                    logger.warning("Failed Delete: %s", act.id)
+                if done % progress_step == 0 or done == total:
+                    logger.info(f"Delete progress: {done} of {total} activities")
+        logger.info(f"Delete finished: {deleted} deleted, {failed} failed")
+        return failed == 0
 
     def get_all_activities_for_account(
             self,
             account_id: str
     ) -> list[GhostfolioImportActivity]:
-        acts: list[GhostfolioImportActivity] = self.get_all_activities()
-        filtered_acts: list[GhostfolioImportActivity] = []
-        for act in acts:
-            if act.accountId == account_id:
-                filtered_acts.append(act)
-        return filtered_acts
+        return list(self.iter_activities(account_id))
 
     @staticmethod
     def map_activity_to_import_activity(act) -> GhostfolioImportActivity:
@@ -274,36 +578,48 @@ class GhostfolioApi:
             act['unitPrice'],
             act['accountId'],
             act.get('comment'),
+            act.get('id'),
         )
         return import_activity
 
     def create_account(self, account):
         url = f"{self.ghost_host}/api/v1/account"
 
-        payload = json.dumps(account)
-        headers = {
-            'Authorization': f"Bearer {self.ghost_token}",
-            'Content-Type': 'application/json'
-        }
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
+            response = self.client.post("api/v1/account", json=account)
         except Exception as e:
             print(e)
             return ""
         if response.status_code == 201:
+            cache.delete(self.__accounts_cache_key())
             return response.json()["id"]
         logger.warning(f"create_account: Failed creating {url}: {account}")
         return ""
 
-    @cache.memoize(tag='get_ghostfolio_accounts', expire=600)
     def get_ghostfolio_accounts(self):
+        accounts = cache.get(self.__accounts_cache_key())
+        if accounts is not None:
+            RunMetrics.count("accounts_cache_hits")
+            return accounts
+        RunMetrics.count("accounts_cache_misses")
+        accounts = self.__get_ghostfolio_accounts()
+        # a failed request also returns no accounts, that is not kept
+        if accounts:
+            cache.set(self.__accounts_cache_key(), accounts,
+                      expire=ACCOUNTS_CACHE_EXPIRE, tag=CacheManager.TAG_ACCOUNTS)
+        return accounts
+
+    def __accounts_cache_key(self):
+        # the token is a secret, only its hash goes into the cache
+        return ("accounts", self.ghost_host,
+                CacheManager.secret_hash(self.ghost_token))
+
+    def __get_ghostfolio_accounts(self):
         url = f"{self.ghost_host}/api/v1/account"
 
-        payload = {}
-        headers = self.__get_header_with_ghostfolio_auth()
         try:
             self.__log_request(url)
-            response = requests.request("GET", url, headers=headers, data=payload)
+            response = self.client.get("api/v1/account")
         except Exception as e:
             logger.error(e)
             return []
@@ -318,43 +634,77 @@ class GhostfolioApi:
                              "renew token")
             raise Exception(response)
 
+    def get_request_stats(self):
+        return self.client.get_stats()
+
+    def log_request_stats(self):
+        self.client.log_stats()
+
+    def reset_request_stats(self):
+        self.client.reset_stats()
+
     def get_ticker(self, isin, symbol) -> GhostfolioTicker:
-        override: SymbolLookupOverride = self.__lookup_overrides(isin, symbol)
-        if override.exists:
-            return GhostfolioTicker(
-                override.data_source,
-                override.symbol,
-                override.currency
-            )
-        # for now only yahoo
-        data_source = DATA_SOURCE_YAHOO
-        successful, ticker = self.__lookup_asset(isin)
-        if not successful:
-            successful, ticker = self.__lookup_asset(symbol)
-            if not successful:
-                raise Exception(f"no symbol found for {isin} {symbol}")
-        return GhostfolioTicker(
-            data_source,
-            ticker.get('symbol'),
-            ticker.get('currency')
-        )
+        for query in (isin, symbol):
+            if query is None:
+                continue
+            entry = symbol_index.get(query)
+            if entry is None:
+                RunMetrics.count("symbol_index_misses")
+                entry = SymbolResolver.get_resolver(self.ghost_host).lookup(
+                    query, self.__lookup_asset)
+            else:
+                RunMetrics.count("symbol_index_hits")
+            if entry is not None and entry.found:
+                return GhostfolioTicker(
+                    entry.data_source,
+                    entry.symbol,
+                    entry.currency
+                )
+        raise Exception(f"no symbol found for {isin} {symbol}")
+
+    def resolve_tickers(self, isin_symbols) -> dict[tuple, GhostfolioTicker]:
+        """
+        Resolves distinct (isin, symbol) pairs concurrently.
+        Pairs without a ticker are logged and left out of the result.
+        """
+        pairs = sorted(set(isin_symbols), key=lambda x: (str(x[0]), str(x[1])))
+        with ThreadPoolExecutor(max_workers=envConf.lookup_concurrency(),
+                                thread_name_prefix="lookup") as executor:
+            futures = [executor.submit(contextvars.copy_context().run,
+                                       self.get_ticker,
+                                       isin,
+                                       symbol)
+                       for isin, symbol in pairs]
+        tickers = {}
+        for pair, future in zip(pairs, futures):
+            try:
+                tickers[pair] = future.result()
+            except Exception as e:
+                logger.warning(f"resolve_tickers {pair}: {e}")
+        logger.debug(f"resolved {len(tickers)} of {len(pairs)} symbols")
+        return tickers
 
-    @cache.memoize(tag='__lookup_asset')
     def __lookup_asset(self, query):
         url = f"{self.ghost_host}/api/v1/symbol/lookup?query={query}"
-        headers = self.__get_header_with_ghostfolio_auth()
         try:
             self.__log_request(url)
-            response = requests.request("GET", url, headers=headers)
-            return self.validate_and_convert_response_to_assets(response)
+            response = self.client.get("api/v1/symbol/lookup",
+                                       params={"query": query})
+            successful, ticker, fuzzy_matches = \
+                self.validate_and_convert_response_to_assets(response)
         except Exception as e:
             self.__log_request_error(url, f"lookup asset: {query} failed with {e}")
-            return False, None
-
-    @staticmethod
-    def __generate_chunks(lst: list[GhostfolioImportActivity], n):
-        for i in range(0, len(lst), n):
-            yield lst[i:i + n]
+            return None
+        if not successful:
+            return symbol_index.record(query)
+        # for now only yahoo
+        return symbol_index.record(
+            query,
+            DATA_SOURCE_YAHOO,
+            ticker.get('symbol'),
+            ticker.get('currency'),
+            [item.get('symbol') for item in fuzzy_matches],
+        )
 
     def __get_header_with_ghostfolio_auth(self):
         return {
@@ -369,24 +719,11 @@ class GhostfolioApi:
         previous_function_name = sys._getframe(1).f_code.co_name
         logger.error(f"{previous_function_name} {url}: {message}")
 
-    def __lookup_overrides(self, isin, symbol) -> SymbolLookupOverride:
-        # TODO create a way to lookup stuff
-        if isin == 'DE000A3MQQ17':
-            return SymbolLookupOverride(True, DATA_SOURCE_YAHOO, 'FRE.DE', 'EUR')
-        if isin == 'NL0015001L59':
-            return SymbolLookupOverride(True, DATA_SOURCE_YAHOO, 'SHEL.L', 'GBp')
-        if isin == 'US09075V1026':
-            return SymbolLookupOverride(True, DATA_SOURCE_YAHOO, 'BNTX', 'USD')
-        if isin == 'DE000A40UTE1':
-            return SymbolLookupOverride(True, DATA_SOURCE_YAHOO, 'AR40.HM', 'EUR')
-        return SymbolLookupOverride(False, None, None, None)
-
     def __get_ibkr_platform_id(self):
         url = f"{self.ghost_host}/api/v1/info"
-        headers = self.__get_header_with_ghostfolio_auth()
         try:
             self.__log_request(url)
-            response = requests.request("GET", url, headers=headers)
+            response = self.client.get("api/v1/info")
             for platform in response.json()['platforms']:
                 if platform['name'] == self.ibkr_platform_name:
                     return platform['id']
@@ -395,26 +732,3 @@ class GhostfolioApi:
         except Exception as e:
             self.__log_request_error(url, f"lookup failed with {e}")
             return None
-
-    def get_dividends_to_import(self, account_id, isin):
-        ticker = self.get_ticker(isin, None)
-        import_list = list(filter(lambda x: x.accountId == account_id,
-                                  self.__get_dividends_to_import(ticker)))
-        if import_list:
-            return import_list
-        return None
-
-    def __get_dividends_to_import(self, ticker) -> list[GhostfolioImportActivity]:
-        url = f"{self.ghost_host}/api/v1/" \
-              f"import/dividends/{ticker.data_source}/{ticker.symbol}"
-        headers = self.__get_header_with_ghostfolio_auth()
-        try:
-            self.__log_request(url)
-            response = requests.request("GET", url, headers=headers)
-            activities_existing = list(response.json().get('activities'))
-            activities_to_import = list(filter(lambda x: x.get('error') is None,
-                                               activities_existing))
-            return list(map(lambda x: self.map_activity_to_import_activity(x),
-                            activities_to_import))
-        except Exception as e:
-            self.__log_request_error(url, f"lookup dividens: failed with {e}")
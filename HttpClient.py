@@ -0,0 +1,138 @@
+import threading
+import time
+from collections import namedtuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import LoggerFactory
+import Resilience
+from EnvironmentConfiguration import EnvironmentConfiguration
+
+EndpointStats = namedtuple('EndpointStats',
+                           'count errors retries total_seconds max_seconds')
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+# safe to send again, the server did not or cannot have applied them twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# for other methods: the server refused the request without processing it
+RETRY_STATUS_CODES_NOT_IDEMPOTENT = {429, 503}
+
+envConf = EnvironmentConfiguration()
+logger = LoggerFactory.logger
+
+
+class HttpClient:
+    """
+    Pooled HTTP client for a single host.
+
+    Keeps one requests.Session (keep-alive, connection pool), applies the
+    default headers and timeout to every call and records count and latency
+    per endpoint. Endpoints are named by method and path template, e.g.
+    "DELETE api/v1/order/{id}", so ids do not split the statistics.
+
+    Calls go through the host's rate limiter and the endpoint's circuit
+    breaker, failed calls are retried with backoff (see Resilience).
+    """
+
+    def __init__(self, host, headers=None, pool_size=10, timeout=30):
+        self.host = host
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+        self.__stats = {}
+        self.__stats_lock = threading.Lock()
+        self.rate_limiter = Resilience.get_rate_limiter(host,
+                                                        envConf.ghost_rate_limit())
+        self.retry_policy = Resilience.get_retry_policy()
+
+    def request(self, method, path, endpoint=None, **kwargs) -> requests.Response:
+        url = f"{self.host}/{path}"
+        kwargs.setdefault('timeout', self.timeout)
+        name = f"{method} {endpoint or path}"
+        breaker = Resilience.get_circuit_breaker(f"{self.host} {name}")
+        retry_codes = RETRY_STATUS_CODES if method in IDEMPOTENT_METHODS \
+            else RETRY_STATUS_CODES_NOT_IDEMPOTENT
+        attempt = 1
+        while True:
+            breaker.before_call()
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.__record(name, time.perf_counter() - start, True, attempt > 1)
+                breaker.record_failure()
+                if method not in IDEMPOTENT_METHODS \
+                        or attempt >= self.retry_policy.max_attempts:
+                    raise
+                self.retry_policy.sleep(attempt)
+                attempt += 1
+                continue
+            except BaseException:
+                # any other error ends the call too, a trial call would
+                # otherwise keep the circuit open for good
+                self.__record(name, time.perf_counter() - start, True, attempt > 1)
+                breaker.record_failure()
+                raise
+            self.__record(name, time.perf_counter() - start,
+                          response.status_code >= 400, attempt > 1)
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if response.status_code not in retry_codes \
+                    or attempt >= self.retry_policy.max_attempts:
+                return response
+            self.retry_policy.sleep(
+                attempt,
+                Resilience.parse_retry_after(response.headers.get('Retry-After')))
+            attempt += 1
+
+    def get(self, path, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("GET", path, endpoint, **kwargs)
+
+    def post(self, path, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("POST", path, endpoint, **kwargs)
+
+    def put(self, path, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("PUT", path, endpoint, **kwargs)
+
+    def delete(self, path, endpoint=None, **kwargs) -> requests.Response:
+        return self.request("DELETE", path, endpoint, **kwargs)
+
+    def get_stats(self) -> dict[str, EndpointStats]:
+        with self.__stats_lock:
+            return dict(self.__stats)
+
+    def reset_stats(self):
+        with self.__stats_lock:
+            self.__stats = {}
+
+    def log_stats(self):
+        for name, stats in sorted(self.get_stats().items(),
+                                  key=lambda x: x[1].total_seconds,
+                                  reverse=True):
+            logger.info(f"{self.host} {name}: {stats.count} calls, "
+                        f"{stats.errors} errors, {stats.retries} retries, "
+                        f"{stats.total_seconds:.3f}s total, "
+                        f"{stats.max_seconds:.3f}s max")
+
+    def close(self):
+        self.session.close()
+
+    def __record(self, name, elapsed, failed, retry):
+        with self.__stats_lock:
+            stats = self.__stats.get(name, EndpointStats(0, 0, 0, 0.0, 0.0))
+            self.__stats[name] = EndpointStats(
+                stats.count + 1,
+                stats.errors + (1 if failed else 0),
+                stats.retries + (1 if retry else 0),
+                stats.total_seconds + elapsed,
+                max(stats.max_seconds, elapsed),
+            )
@@ -1,19 +1,40 @@
+from __future__ import annotations
+
+import json
+import time
+import zlib
 from collections import namedtuple
-from datetime import datetime
+from typing import TYPE_CHECKING
 
-from diskcache import Cache
-from ibflex import client, parser, FlexQueryResponse, CashAction, CashTransaction, Trade
-from ibflex.client import ResponseCodeError
+from requests import RequestException
 
+import CacheManager
+import DebugDump
 import LoggerFactory
+import Resilience
+import RunMetrics
 from EnvironmentConfiguration import EnvironmentConfiguration
 
+# ibflex takes a quarter of a second to import, it is only imported once a
+# statement is downloaded or parsed
+if TYPE_CHECKING:
+    from ibflex import FlexQueryResponse, CashTransaction, Trade
+
 IbkrConfig = namedtuple('IbkrConfig',
                         'token query_id')
 
 logger = LoggerFactory.logger
 envConf = EnvironmentConfiguration()
-cache = Cache(directory=envConf.file_write_location()+'.cache/ibkr-api')
+cache = CacheManager.LazyCache("ibkr-api")
+QUERY_CACHE_EXPIRE = 3600
+# Flex Web Service errors that go away by themselves: statement not ready or
+# could not be generated right now, server busy, too many requests
+RETRY_RESPONSE_CODES = {"1001", "1004", "1009", "1018", "1019", "1021"}
+IBKR_NOT_READY_DELAY = 10
+# polls for a statement that is still being generated
+IBKR_STATEMENT_TRIES = 6
+# the Flex Web Service allows about one request per second per token
+IBKR_RATE_LIMIT = 1
 
 
 class IbkrApi:
@@ -22,13 +43,92 @@ class IbkrApi:
         self.ibkr_token = ibkr_config.token
         self.ibkr_query = ibkr_config.query_id
 
-    @cache.memoize(expire=3600, tag='query')
     def get_and_parse_query(self):
+        import FlexStream
+        extract_key = self.__cache_key("extract", FlexStream.EXTRACT_VERSION)
+        columns = cache.get(extract_key)
+        if columns is not None:
+            logger.debug("Using cached query extract")
+            RunMetrics.count("flex_extract_cache_hits")
+            with RunMetrics.span("parse"):
+                return FlexStream.from_columns(json.loads(zlib.decompress(columns)))
+        with RunMetrics.span("download"):
+            response = self.download_query()
+        with RunMetrics.span("parse"):
+            query = self.parse_query(response)
+        cache.set(extract_key,
+                  zlib.compress(json.dumps(FlexStream.to_columns(query)).encode()),
+                  expire=QUERY_CACHE_EXPIRE, tag=CacheManager.TAG_QUERY)
+        return query
+
+    def download_query(self) -> bytes:
+        """The raw statement, from the cache if downloaded recently."""
+        xml_key = self.__cache_key("xml")
+        compressed_response = cache.get(xml_key)
+        if compressed_response is not None:
+            logger.debug("Using cached query")
+            RunMetrics.count("flex_xml_cache_hits")
+            return zlib.decompress(compressed_response)
+        RunMetrics.count("flex_cache_misses")
+        response = self.__download_query()
+        cache.set(xml_key, zlib.compress(response),
+                  expire=QUERY_CACHE_EXPIRE, tag=CacheManager.TAG_QUERY)
+        return response
+
+    @staticmethod
+    def parse_query(response: bytes):
+        import FlexStream
+        from ibflex import parser
+        if envConf.is_flex_stream_parse_enabled():
+            logger.debug("Parsing Query (streaming)")
+            return FlexStream.parse_stream(response)
+        logger.debug("Parsing Query")
+        return parser.parse(response)
+
+    def __download_query(self):
+        from ibflex.client import BadResponseError, ResponseCodeError, \
+            StatementGenerationTimeout
+        retry_policy = Resilience.get_retry_policy()
+        # per token, one account's failures or requests do not hold up others
+        token_hash = CacheManager.secret_hash(self.ibkr_token)
+        rate_limiter = Resilience.get_rate_limiter(f"ibkr flex {token_hash}",
+                                                   IBKR_RATE_LIMIT)
+        breaker = Resilience.get_circuit_breaker(f"ibkr flex download {token_hash}")
+        attempt = 1
+        while True:
+            breaker.before_call()
+            rate_limiter.acquire()
+            try:
+                response = self.__download_query_once()
+            except BaseException as e:
+                # every failure ends the call, a trial call would otherwise
+                # keep the circuit open for good
+                breaker.record_failure()
+                retryable = isinstance(e, (ResponseCodeError,
+                                           StatementGenerationTimeout,
+                                           RequestException, BadResponseError)) \
+                    and not (isinstance(e, ResponseCodeError)
+                             and str(e.code) not in RETRY_RESPONSE_CODES)
+                if not retryable or attempt >= retry_policy.max_attempts:
+                    raise
+                logger.warning(f"Fetching Query failed, retrying: {e}")
+                # statements not ready yet are worth a longer wait than the backoff
+                retry_after = IBKR_NOT_READY_DELAY \
+                    if isinstance(e, (ResponseCodeError, StatementGenerationTimeout)) \
+                    else None
+                retry_policy.sleep(attempt, retry_after)
+                attempt += 1
+                continue
+            breaker.record_success()
+            return response
+
+    def __download_query_once(self):
+        from ibflex.client import ResponseCodeError
         logger.debug("Fetching Query")
         try:
-            response = client.download(self.ibkr_token, self.ibkr_query)
+            response = self.__download_statement()
         except ResponseCodeError as responseCodeError:
-            if responseCodeError.code == 1012:
+            if str(responseCodeError.code) == "1012":
                 logger.error("Token Expired! "
                              "see "
                              "https://www.interactivebrokers.com.au/en/?f=asr_statemen"
@@ -39,9 +139,34 @@ class IbkrApi:
             raise responseCodeError
         if envConf.is_debug_files_enabled():
             self.__query_to_file(response)
-        logger.debug("Parsing Query")
-        query: FlexQueryResponse = parser.parse(response)
-        return query
+        return response
+
+    def __download_statement(self):
+        from ibflex import client
+        from ibflex.client import StatementGenerationTimeout
+        # client.download without the hard coded request url
+        statement_access = client.request_statement(
+            self.ibkr_token, self.ibkr_query, url=envConf.ibkr_flex_url())
+        tries = 0
+        status = 0
+        while status is not True:
+            time.sleep(status)
+            tries += 1
+            response = client.submit_request(
+                url=statement_access.Url or client.STMT_URL,
+                token=self.ibkr_token,
+                query=statement_access.ReferenceCode,
+            )
+            status = client.check_statement_response(response)
+            if status is not True and tries >= IBKR_STATEMENT_TRIES:
+                raise StatementGenerationTimeout(
+                    "Exceeded max number of tries while attempting download")
+        return response.content
+
+    def __cache_key(self, *parts):
+        # the token is a secret, only its hash goes into the cache
+        return ("query", CacheManager.secret_hash(self.ibkr_token),
+                self.ibkr_query) + parts
 
     @staticmethod
     def get_stock_transactions(query: FlexQueryResponse) -> list[Trade]:
@@ -70,6 +195,7 @@ class IbkrApi:
 
     @staticmethod
     def get_cash_transactions(query) -> list[CashTransaction]:
+        from ibflex import CashAction
         cash_action_types: list[CashAction] = [CashAction.DIVIDEND,
                                                CashAction.PAYMENTINLIEU,
                                                CashAction.WHTAX]
@@ -90,9 +216,4 @@ class IbkrApi:
         return list(set(map(lambda x: x.isin, cash_transactions)))
 
     def __query_to_file(self, response):
-        timestamp = f"{datetime.now().strftime('%Y-%m-%d_%H:%M:%S')}"
-        folder = envConf.file_write_location()
-        filename = f"{folder}{timestamp}-ib_flex_query-{self.ibkr_query}.xml"
-        logger.warning(f"writing query to {filename}")
-        with open(filename, 'wb') as outfile:
-            outfile.write(response)
+        DebugDump.write_bytes(f"ib_flex_query-{self.ibkr_query}", "xml", response)
@@ -1,3 +1,6 @@
+import contextvars
+import logging
+
 import colorlog
 
 from EnvironmentConfiguration import EnvironmentConfiguration
@@ -5,12 +8,28 @@ from EnvironmentConfiguration import EnvironmentConfiguration
 envConf = EnvironmentConfiguration()
 log_level = envConf.log_level()
 
+# prefix of the sync currently running in this context, e.g. "[#2 123456] "
+log_prefix = contextvars.ContextVar('log_prefix', default="")
+
+
+class LogPrefixFilter(logging.Filter):
+    def filter(self, record):
+        record.log_prefix = log_prefix.get()
+        return True
+
+
+def set_log_prefix(prefix):
+    log_prefix.set(f"[{prefix}] " if prefix else "")
+
+
 handler = colorlog.StreamHandler()
+handler.addFilter(LogPrefixFilter())
 handler.setFormatter(
     colorlog.ColoredFormatter(
-        '%(log_color)s%(asctime)s %(levelname)s:%(filename)s: %(message)s'
+        '%(log_color)s%(asctime)s %(levelname)s:%(filename)s: '
+        '%(log_prefix)s%(message)s'
     )
 )
 logger = colorlog.getLogger()
 logger.setLevel(log_level)
-logger.addHandler(handler)
\ No newline at end of file
+logger.addHandler(handler)
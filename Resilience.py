@@ -0,0 +1,155 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import LoggerFactory
+from EnvironmentConfiguration import EnvironmentConfiguration
+
+envConf = EnvironmentConfiguration()
+logger = LoggerFactory.logger
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint that failed too often recently."""
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped at max_delay."""
+
+    def __init__(self, max_attempts, base_delay, max_delay):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before the given retry (1 is the first retry)."""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay,
+                                     self.base_delay * 2 ** (attempt - 1)))
+
+    def sleep(self, attempt, retry_after=None):
+        delay = self.delay(attempt, retry_after)
+        logger.debug(f"retry {attempt} of {self.max_attempts - 1} in {delay:.2f}s")
+        time.sleep(delay)
+
+
+class TokenBucket:
+    """Allows rate calls per second on average, with bursts of up to burst calls."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.__tokens = self.burst
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.burst,
+                                    self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_timeout seconds. After that a single trial call is let through,
+    its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.__failures = 0
+        self.__opened_at = None
+        self.__trial_running = False
+        self.__lock = threading.Lock()
+
+    def before_call(self):
+        if self.failure_threshold <= 0:
+            return
+        with self.__lock:
+            if self.__opened_at is None:
+                return
+            if time.monotonic() - self.__opened_at < self.reset_timeout \
+                    or self.__trial_running:
+                raise CircuitOpenError(f"circuit open for {self.name} after "
+                                       f"{self.__failures} failures")
+            self.__trial_running = True
+
+    def record_success(self):
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial_running = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.__failures += 1
+            self.__trial_running = False
+            if self.failure_threshold > 0 \
+                    and self.__failures >= self.failure_threshold:
+                if self.__opened_at is None:
+                    logger.warning(f"opening circuit for {self.name} after "
+                                   f"{self.__failures} failures")
+                self.__opened_at = time.monotonic()
+
+
+_registry_lock = threading.Lock()
+_rate_limiters = {}
+_circuit_breakers = {}
+
+
+def get_rate_limiter(host, rate) -> TokenBucket:
+    """Process wide token bucket per host, shared by all clients of that host."""
+    with _registry_lock:
+        if host not in _rate_limiters:
+            _rate_limiters[host] = TokenBucket(rate, rate)
+        return _rate_limiters[host]
+
+
+def get_circuit_breaker(name) -> CircuitBreaker:
+    with _registry_lock:
+        if name not in _circuit_breakers:
+            _circuit_breakers[name] = CircuitBreaker(
+                name,
+                envConf.circuit_breaker_threshold(),
+                envConf.circuit_breaker_reset(),
+            )
+        return _circuit_breakers[name]
+
+
+def get_retry_policy() -> RetryPolicy:
+    return RetryPolicy(envConf.retry_max_attempts(),
+                       envConf.retry_base_delay(),
+                       envConf.retry_max_delay())
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,212 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import LoggerFactory
+
+logger = LoggerFactory.logger
+
+METRIC_PREFIX = "ghostfolio_sync"
+
+
+class RunMetrics:
+    """
+    Spans and counters of one operation of one account.
+
+    Span times are exclusive: a span nested in another one is not counted
+    in its parent, so the spans of one thread add up to at most the
+    duration. Spans of threads running at the same time (the sync pipeline)
+    overlap, the wait_* spans show how long the sync waited for them.
+    """
+
+    def __init__(self, label, operation):
+        self.label = label
+        self.operation = operation
+        self.started = datetime.now()
+        self.success = None
+        self.seconds = None
+        self.spans = {}
+        self.counters = {}
+        self.http = {}
+        self.__lock = threading.Lock()
+        self.__stacks = threading.local()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        stack = self.__get_stack()
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            with self.__lock:
+                self.spans[name] = self.spans.get(name, 0.0) + elapsed
+                if stack:
+                    self.spans[stack[-1]] = self.spans.get(stack[-1], 0.0) - elapsed
+
+    def timed_iter(self, name, iterable):
+        """
+        Yields from iterable, the time spent producing items goes to span name,
+        the number of items to counter name.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.span(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            self.count(name)
+            yield item
+
+    def count(self, name, value=1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_http_stats(self, stats):
+        """EndpointStats per endpoint, as returned by HttpClient.get_stats."""
+        self.http = {name: stats._asdict() for name, stats in stats.items()}
+
+    def finish(self, success, seconds):
+        self.success = success
+        self.seconds = seconds
+
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "operation": self.operation,
+            "started": self.started.isoformat(timespec='seconds'),
+            "success": self.success,
+            "seconds": self.seconds,
+            "spans": dict(self.spans),
+            "counters": dict(self.counters),
+            "http": dict(self.http),
+        }
+
+    def __get_stack(self):
+        if not hasattr(self.__stacks, 'names'):
+            self.__stacks.names = []
+        return self.__stacks.names
+
+
+# metrics of the operation currently running in this context
+current_run = contextvars.ContextVar('current_run', default=None)
+
+
+def start_run(label, operation) -> RunMetrics:
+    metrics = RunMetrics(label, operation)
+    current_run.set(metrics)
+    return metrics
+
+
+def span(name):
+    """Span of the current run, does nothing outside of a run."""
+    metrics = current_run.get()
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.span(name)
+
+
+def timed_iter(name, iterable):
+    metrics = current_run.get()
+    if metrics is None:
+        return iterable
+    return metrics.timed_iter(name, iterable)
+
+
+def count(name, value=1):
+    metrics = current_run.get()
+    if metrics is not None:
+        metrics.count(name, value)
+
+
+def set_http_stats(stats):
+    metrics = current_run.get()
+    if metrics is not None:
+        metrics.set_http_stats(stats)
+
+
+def write_report(path, runs: list[RunMetrics]):
+    report = {
+        "created": datetime.now().isoformat(timespec='seconds'),
+        "success": all(run.success for run in runs),
+        "runs": [run.to_dict() for run in runs],
+    }
+    write_atomically(path, json.dumps(report, indent=2))
+    logger.debug(f"run report written to {path}")
+
+
+def write_prometheus_textfile(path, runs: list[RunMetrics]):
+    """Writes the runs in the node_exporter textfile collector format."""
+    lines = [
+        f"# HELP {METRIC_PREFIX}_success 1 if the last run of the account succeeded",
+        f"# TYPE {METRIC_PREFIX}_success gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_success{labels(run)} {int(bool(run.success))}"
+              for run in runs]
+    lines += [
+        f"# HELP {METRIC_PREFIX}_duration_seconds duration of the last run",
+        f"# TYPE {METRIC_PREFIX}_duration_seconds gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_duration_seconds{labels(run)} {run.seconds or 0}"
+              for run in runs]
+    lines += [
+        f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds start of the last run",
+        f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_last_run_timestamp_seconds{labels(run)} "
+              f"{run.started.timestamp():.0f}"
+              for run in runs]
+    lines += [
+        f"# HELP {METRIC_PREFIX}_phase_seconds time spent per phase of the last run",
+        f"# TYPE {METRIC_PREFIX}_phase_seconds gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_phase_seconds{labels(run, phase=name)} {seconds}"
+              for run in runs for name, seconds in sorted(run.spans.items())]
+    lines += [
+        f"# HELP {METRIC_PREFIX}_count counters of the last run",
+        f"# TYPE {METRIC_PREFIX}_count gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_count{labels(run, name=name)} {value}"
+              for run in runs for name, value in sorted(run.counters.items())]
+    lines += [
+        f"# HELP {METRIC_PREFIX}_http_requests requests per endpoint of the last run",
+        f"# TYPE {METRIC_PREFIX}_http_requests gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_http_requests{labels(run, endpoint=name)} "
+              f"{stats['count']}"
+              for run in runs for name, stats in sorted(run.http.items())]
+    lines += [
+        f"# HELP {METRIC_PREFIX}_http_errors failed requests per endpoint "
+        f"of the last run",
+        f"# TYPE {METRIC_PREFIX}_http_errors gauge",
+    ]
+    lines += [f"{METRIC_PREFIX}_http_errors{labels(run, endpoint=name)} "
+              f"{stats['errors']}"
+              for run in runs for name, stats in sorted(run.http.items())]
+    write_atomically(path, "\n".join(lines) + "\n")
+    logger.debug(f"prometheus metrics written to {path}")
+
+
+def labels(run: RunMetrics, **extra):
+    values = {"account": run.label, "operation": run.operation, **extra}
+    return "{" + ",".join(f'{key}="{escape_label(value)}"'
+                          for key, value in values.items()) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_atomically(path, content):
+    # readers (node_exporter, dashboards) never see a partially written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as outfile:
+        outfile.write(content)
+    os.replace(temp_path, path)
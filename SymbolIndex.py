@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import LoggerFactory
+from EnvironmentConfiguration import EnvironmentConfiguration
+
+SymbolIndexEntry = namedtuple('SymbolIndexEntry',
+                              'found data_source symbol currency source updated '
+                              'fuzzy_matches')
+
+SYMBOL_INDEX_VERSION = 1
+SOURCE_OVERRIDE = "override"
+SOURCE_LOOKUP = "lookup"
+
+# seeded into a new index file, edit the file to add or change overrides
+DEFAULT_OVERRIDES = {
+    'DE000A3MQQ17': ('YAHOO', 'FRE.DE', 'EUR'),
+    'NL0015001L59': ('YAHOO', 'SHEL.L', 'GBp'),
+    'US09075V1026': ('YAHOO', 'BNTX', 'USD'),
+    'DE000A40UTE1': ('YAHOO', 'AR40.HM', 'EUR'),
+}
+
+envConf = EnvironmentConfiguration()
+logger = LoggerFactory.logger
+
+
+class SymbolIndex:
+    """
+    Persistent ISIN/symbol -> (dataSource, symbol, currency) table.
+
+    Backed by a json file the user can edit. Entries with source "override"
+    never expire, entries from Ghostfolio lookups expire after their TTL,
+    negative ones (nothing found) sooner than positive ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.__entries = None
+        self.__lock = threading.RLock()
+
+    def get(self, key) -> SymbolIndexEntry:
+        """Returns the entry for key, or None if unknown or expired."""
+        entry = self.__get_entries().get(key)
+        if entry is None or self.__is_expired(entry):
+            return None
+        return entry
+
+    def record(self, key, data_source=None, symbol=None, currency=None,
+               fuzzy_matches=None):
+        """Stores a lookup result, a result without symbol is a negative entry."""
+        entry = SymbolIndexEntry(
+            symbol is not None,
+            data_source,
+            symbol,
+            currency,
+            SOURCE_LOOKUP,
+            datetime.now().isoformat(timespec='seconds'),
+            list(fuzzy_matches) if fuzzy_matches else None,
+        )
+        with self.__lock:
+            existing = self.__get_entries().get(key)
+            if existing is not None and existing.source == SOURCE_OVERRIDE:
+                return existing
+            self.__entries[key] = entry
+            self.__save()
+        return entry
+
+    def invalidate(self, key) -> bool:
+        """Forgets the lookup result of key, overrides stay."""
+        with self.__lock:
+            entry = self.__get_entries().get(key)
+            if entry is None or entry.source == SOURCE_OVERRIDE:
+                return False
+            del self.__entries[key]
+            self.__save()
+        return True
+
+    def prune(self) -> int:
+        """Removes expired lookup results, returns how many."""
+        with self.__lock:
+            expired = [key for key, entry in self.__get_entries().items()
+                       if self.__is_expired(entry)]
+            for key in expired:
+                del self.__entries[key]
+            if expired:
+                self.__save()
+        return len(expired)
+
+    def get_fuzzy_matches(self) -> dict[str, list[str]]:
+        return {key: entry.fuzzy_matches
+                for key, entry in self.__get_entries().items()
+                if entry.fuzzy_matches}
+
+    def __is_expired(self, entry: SymbolIndexEntry):
+        if entry.source == SOURCE_OVERRIDE:
+            return False
+        if entry.updated is None:
+            return True
+        ttl = envConf.symbol_index_ttl() if entry.found \
+            else envConf.symbol_index_negative_ttl()
+        return datetime.fromisoformat(entry.updated) + ttl < datetime.now()
+
+    def __get_entries(self) -> dict[str, SymbolIndexEntry]:
+        if self.__entries is None:
+            with self.__lock:
+                if self.__entries is None:
+                    self.__entries = self.__load()
+        return self.__entries
+
+    def __load(self):
+        if not os.path.exists(self.path):
+            logger.info(f"creating symbol index {self.path}")
+            entries = {isin: SymbolIndexEntry(True, data_source, symbol, currency,
+                                              SOURCE_OVERRIDE, None, None)
+                       for isin, (data_source, symbol, currency)
+                       in DEFAULT_OVERRIDES.items()}
+            self.__entries = entries
+            self.__save()
+            return entries
+        with open(self.path) as infile:
+            content = json.load(infile)
+        version = content.get('version')
+        if version != SYMBOL_INDEX_VERSION:
+            logger.warning(f"symbol index {self.path} has version {version}, "
+                           f"expected {SYMBOL_INDEX_VERSION}, ignoring lookups")
+            return {key: entry for key, entry
+                    in self.__parse_entries(content).items()
+                    if entry.source == SOURCE_OVERRIDE}
+        return self.__parse_entries(content)
+
+    @staticmethod
+    def __parse_entries(content):
+        entries = {}
+        for key, value in content.get('symbols', {}).items():
+            source = value.get('source', SOURCE_OVERRIDE)
+            entries[key] = SymbolIndexEntry(
+                value.get('found', value.get('symbol') is not None),
+                value.get('dataSource'),
+                value.get('symbol'),
+                value.get('currency'),
+                source,
+                value.get('updated'),
+                value.get('fuzzyMatches'),
+            )
+        return entries
+
+    def __save(self):
+        symbols = {}
+        for key, entry in sorted(self.__entries.items()):
+            value = {"source": entry.source}
+            if entry.source != SOURCE_OVERRIDE:
+                value["found"] = entry.found
+            if entry.found:
+                value["dataSource"] = entry.data_source
+                value["symbol"] = entry.symbol
+                value["currency"] = entry.currency
+            if entry.updated is not None:
+                value["updated"] = entry.updated
+            if entry.fuzzy_matches:
+                value["fuzzyMatches"] = entry.fuzzy_matches
+            symbols[key] = value
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as outfile:
+            json.dump({"version": SYMBOL_INDEX_VERSION, "symbols": symbols},
+                      outfile, indent=2)
+        os.replace(temp_path, self.path)
+
+
+symbol_index = SymbolIndex(envConf.symbol_index_file())
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import Future
+
+import LoggerFactory
+import RunMetrics
+from SymbolIndex import symbol_index
+
+logger = LoggerFactory.logger
+
+resolvers = {}
+resolvers_lock = threading.Lock()
+
+
+class SymbolResolver:
+    """
+    Single-flight symbol lookups of one Ghostfolio host, shared by every
+    sync of the process.
+
+    A lookup for a query that is already in flight, from another pair of
+    the same sync or from another portfolio, waits for that call instead of
+    sending its own. Results end up in the symbol index, which also serves
+    them to later syncs.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.deduplicated = 0
+        # query -> Future of the lookup in flight
+        self.__in_flight = {}
+        self.__lock = threading.Lock()
+
+    def lookup(self, query, lookup_asset):
+        """
+        The symbol index entry of query, from lookup_asset(query) unless a
+        lookup of query is in flight or has just been recorded.
+        """
+        with self.__lock:
+            future = self.__in_flight.get(query)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.__in_flight[query] = future
+        if not leader:
+            self.__count_deduplicated(query)
+            return future.result()
+        try:
+            # recorded by a flight that ended after the caller's index miss
+            entry = symbol_index.get(query)
+            if entry is not None:
+                self.__count_deduplicated(query)
+            else:
+                entry = lookup_asset(query)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.__lock:
+                del self.__in_flight[query]
+
+    def __count_deduplicated(self, query):
+        with self.__lock:
+            self.deduplicated += 1
+        RunMetrics.count("symbol_lookups_deduplicated")
+        logger.debug(f"lookup of {query} on {self.host} deduplicated")
+
+
+def get_resolver(host) -> SymbolResolver:
+    with resolvers_lock:
+        if host not in resolvers:
+            resolvers[host] = SymbolResolver(host)
+        return resolvers[host]
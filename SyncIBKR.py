@@ -1,75 +1,46 @@
-import json
-from datetime import datetime
+from __future__ import annotations
 
-from ibflex import FlexQueryResponse, BuySell, Trade
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING
 
+import DebugDump
+import DividendEngine
 import LoggerFactory
+import RunMetrics
+import SyncPlan
+from ActivityDiff import get_diff
 from EnvironmentConfiguration import EnvironmentConfiguration
 from GhostfolioApi import GhostfolioApi, \
     GhostfolioTicker, \
     GhostfolioConfig, \
     GhostfolioImportActivity
 from IbkrApi import IbkrApi, IbkrConfig
+from SyncState import SyncState
+
+if TYPE_CHECKING:
+    from ibflex import FlexQueryResponse, Trade
 
 envConf = EnvironmentConfiguration()
 logger = LoggerFactory.logger
 
 
 def get_cash_amount_from_flex(query):
+    """Ending cash of all statements, including the Paxos (crypto) cash."""
     cash = 0
     for flex_statement in query.FlexStatements:
-        try:
-            cash += flex_statement.CashReport[0].endingCash
-        except Exception as e:
-            logger.info(e)
-        try:
-            cash += flex_statement.CashReport[0].endingCashPaxos
-        except Exception as e:
-            logger.info(e)
+        if not flex_statement.CashReport:
+            logger.info(f"No cash report in the statement of "
+                        f"{flex_statement.accountId}")
+            continue
+        cash_report = flex_statement.CashReport[0]
+        for ending_cash in (cash_report.endingCash, cash_report.endingCashPaxos):
+            if ending_cash is not None:
+                cash += ending_cash
     return cash
 
 
-def format_act(act: GhostfolioImportActivity):
-    return {
-        "accountId": act.accountId,
-        "date": act.date[0:18],
-        "fee": float(act.fee),
-        "quantity": act.quantity,
-        "symbol": act.symbol,
-        "type": act.type,
-        "unitPrice": act.unitPrice,
-    }
-
-
-def is_act_present(
-        act_search: GhostfolioImportActivity,
-        acts: list[GhostfolioImportActivity]
-):
-    # if sync has written id as comment,
-    # extract it, it could be the transaction id
-    comment = act_search.comment
-
-    for act in acts:
-        potential_match_comment = act.comment
-        if comment is not None \
-                and potential_match_comment is not None \
-                and comment.startswith(potential_match_comment):
-            return True
-        act1 = format_act(act)
-        act2 = format_act(act_search)
-        if act1 == act2:
-            return True
-    return False
-
-
-def get_diff(existing_acts, new_acts: list[GhostfolioImportActivity]):
-    diff = []
-    for new_act in new_acts:
-        if not is_act_present(new_act, existing_acts):
-            diff.append(new_act)
-    return diff
-
-
 class SyncIBKR:
     # todo: Id as in ghostfolio
     IBKRCATEGORY = None
@@ -79,73 +50,345 @@ class SyncIBKR:
         self.ibkr_api = IbkrApi(ibkr_config)
         self.ghost_currency = ghost_config.currency
 
-    def sync_ibkr(self):
-        account = self.ghostfolio_api.create_or_get_ibkr_account()
-        account_id = account['id']
-        if account_id == "":
-            logger.warning("Failed to retrieve account ID closing now")
-            return
+    def sync_ibkr(self, full_reconcile=False):
+        return self.apply_plan(self.plan_sync(full_reconcile)).success
+
+    def plan_sync(self, full_reconcile=False) -> SyncPlan.SyncPlan:
+        """
+        Downloads the statement, maps and diffs it against Ghostfolio and
+        returns what a sync would write, without writing anything. An account
+        not created yet is planned as empty and created by apply_plan.
+        """
+        if envConf.is_sync_pipeline_enabled():
+            return self.__plan_sync_pipelined(full_reconcile)
+        account = self.__get_account()
         query: FlexQueryResponse = self.ibkr_api.get_and_parse_query()
+        state, full_reconcile = self.__load_state(account['id'], full_reconcile)
+        return self.__plan_stages(account, state, full_reconcile, query, None)
+
+    def __plan_sync_pipelined(self, full_reconcile):
+        """
+        Same plan as plan_sync, with the stages started as soon as their
+        inputs are ready: the flex download runs while the account, the sync
+        state and, for a full reconcile, the existing activities are read
+        from Ghostfolio.
+        """
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipeline")
+
+        def submit(function, *args):
+            # copy the context so workers keep the log prefix and metrics
+            return executor.submit(contextvars.copy_context().run, function, *args)
+
+        try:
+            query_future = submit(self.ibkr_api.get_and_parse_query)
+            account = self.__get_account()
+            state, full_reconcile = self.__load_state(account['id'], full_reconcile)
+            existing_future = submit(self.__fetch_activities, account['id']) \
+                if full_reconcile else None
+            return self.__plan_stages(account, state, full_reconcile, query_future,
+                                      existing_future)
+        finally:
+            # a failed stage does not wait for the download still running
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __plan_stages(self, account, state, full_reconcile, query,
+                      existing_activities):
+        """
+        The stages after the account and sync state. query and
+        existing_activities are values or futures of them, existing_activities
+        None to read the existing activities only when the diff needs them.
+        """
+        account_id = account['id']
+        query = self.__wait(query, "wait_flex")
+        trades, trade_dates, cash_transactions = self.__get_trades(query, state,
+                                                                   full_reconcile)
+        tickers = self.__resolve_tickers(trades, cash_transactions)
+        activities, transaction_ids, unresolved = self.__map_trades(
+            account_id, trades, tickers)
+        dividends = self.get_dividends_to_import(account_id, cash_transactions,
+                                                 tickers)
+        unsynced_dividends = self.__unsynced_dividends(dividends.activities, state,
+                                                       full_reconcile)
+        existing_dividends = DividendEngine.ExistingDividends()
+        if existing_activities is not None:
+            existing_activities = self.__wait(existing_activities, "wait_activities")
+            diff = self.__diff(existing_dividends.collect(existing_activities),
+                               activities)
+        elif len(activities) > 0 or len(unsynced_dividends) > 0 or full_reconcile:
+            # pages are streamed into the diff, and into the debug dump if enabled
+            with DebugDump.DebugDump(f"activities_from_gf-{account_id}") as dump:
+                diff = self.__diff(existing_dividends.collect(
+                    dump.tee(self.__iter_activities(account_id))), activities)
+        else:
+            diff = []
+        return self.__create_plan(account, full_reconcile,
+                                  get_cash_amount_from_flex(query), activities,
+                                  transaction_ids, trade_dates, diff, dividends,
+                                  unsynced_dividends, existing_dividends, unresolved)
+
+    @staticmethod
+    def __wait(value, span):
+        """value, or the result of value if it is a future of a pipeline stage."""
+        if not isinstance(value, Future):
+            return value
+        with RunMetrics.span(span):
+            return value.result()
+
+    def __get_account(self):
+        with RunMetrics.span("account"):
+            account = self.ghostfolio_api.get_ibkr_account()
+        if account is None:
+            logger.info("No IBKR account yet, planning against an empty account "
+                        "that is created when the plan is applied")
+            return {"id": None, "balance": 0}
+        return account
+
+    def __load_state(self, account_id, full_reconcile):
+        if account_id is None:
+            # nothing was synced to an account not created yet
+            return None, True
+        sync_state = SyncState(self.ghostfolio_api.ghost_host, account_id)
+        state = sync_state.load()
+        full_reconcile = full_reconcile or sync_state.is_full_reconcile_due(state)
+        return state, full_reconcile
+
+    def __get_trades(self, query, state, full_reconcile):
+        """
+        Trades still to sync, the dates of all trades and the dividend and
+        withholding tax cash transactions.
+        """
+        trades = self.ibkr_api.get_stock_transactions(query)
+        RunMetrics.count("trades", len(trades))
+        trade_dates = {str(trade.transactionID): str(trade.tradeDate)
+                       for trade in trades}
+        if not full_reconcile:
+            trades = [trade for trade in trades
+                      if str(trade.transactionID) not in state.transaction_ids]
+            logger.info(f"Incremental sync: {len(trades)} trades not synced yet, "
+                        f"last synced trade {state.last_trade_date}")
+        RunMetrics.count("trades_to_sync", len(trades))
+        return trades, trade_dates, self.ibkr_api.get_cash_transactions(query)
+
+    def __resolve_tickers(self, trades, cash_transactions):
+        with RunMetrics.span("map"):
+            return self.ghostfolio_api.resolve_tickers(
+                {(trade.isin, self.map_symbol(trade)) for trade in trades}
+                | {(cash_transaction.isin, None)
+                   for cash_transaction in cash_transactions
+                   if cash_transaction.isin})
+
+    def __map_trades(self, account_id, trades, tickers):
         activities: list[GhostfolioImportActivity] = []
         date_format = "%Y-%m-%d"
+        # id(activity) -> transactionID, the diff returns the same objects
+        transaction_ids = {}
+        unresolved = set()
+        with RunMetrics.span("map"):
+            for trade in trades:
+                isin_symbol = (trade.isin, self.map_symbol(trade))
+                if isin_symbol not in tickers:
+                    unresolved.add(isin_symbol)
+                    continue
+                activity: GhostfolioImportActivity = self.map_trade_to_gf(
+                    account_id,
+                    date_format,
+                    trade,
+                    tickers)
+                activities.append(activity)
+                transaction_ids[id(activity)] = str(trade.transactionID)
+        RunMetrics.count("unresolved_symbols", len(unresolved))
+        return activities, transaction_ids, unresolved
+
+    @staticmethod
+    def __unsynced_dividends(dividends, state, full_reconcile):
+        if full_reconcile:
+            return dividends
+        return {key: activity for key, activity in dividends.items()
+                if key not in state.transaction_ids}
+
+    def __iter_activities(self, account_id):
+        if account_id is None:
+            # without an account id all activities of the user would be listed
+            return iter(())
+        return RunMetrics.timed_iter("existing_activities",
+                                     self.ghostfolio_api.iter_activities(account_id))
+
+    def __fetch_activities(self, account_id) -> list[GhostfolioImportActivity]:
+        # fetched ahead of the diff, so kept in memory instead of streamed
+        with DebugDump.DebugDump(f"activities_from_gf-{account_id}") as dump:
+            return list(dump.tee(self.__iter_activities(account_id)))
+
+    @staticmethod
+    def __diff(existing_activities, activities):
+        with RunMetrics.span("diff"):
+            diff: list[GhostfolioImportActivity] = get_diff(existing_activities,
+                                                            activities)
+        return diff
+
+    def __create_plan(self, account, full_reconcile, cash, activities,
+                      transaction_ids, trade_dates, diff, dividends,
+                      unsynced_dividends, existing_dividends, unresolved):
+        account_id = account['id']
+        RunMetrics.count("activities_to_import", len(diff))
+        with DebugDump.DebugDump(f"activities_from_ib-{account_id}") as dump:
+            dump.write_all(activities)
+        with DebugDump.DebugDump(f"activities_diff-{account_id}") as dump:
+            dump.write_all(diff)
+        new_dividends = existing_dividends.missing(unsynced_dividends,
+                                                   dividends.windows)
+        RunMetrics.count("dividends_to_import", len(new_dividends))
+        dividend_dates = {key: activity.date[0:10]
+                          for key, activity in dividends.activities.items()}
+        plan = SyncPlan.SyncPlan(
+            SyncPlan.now(),
+            self.ghostfolio_api.ghost_host,
+            account_id,
+            full_reconcile,
+            account.get('balance'),
+            None if cash == 0 else round(float(cash), 2),
+            diff,
+            [transaction_ids[id(activity)] for activity in diff],
+            {transaction_id: trade_dates[transaction_id]
+             for transaction_id in transaction_ids.values()},
+            min(list(trade_dates.values()) + list(dividend_dates.values()),
+                default=None),
+            list(new_dividends.values()),
+            list(new_dividends.keys()),
+            {key: dividend_dates[key] for key in unsynced_dividends},
+            sorted(unresolved, key=str))
+        plan.log_summary()
+        return plan
 
-        self.set_cash_to_account(account_id, get_cash_amount_from_flex(query))
-        for trade in self.ibkr_api.get_stock_transactions(query):
-            activity: GhostfolioImportActivity = self.map_trade_to_gf(
-                account_id,
-                date_format,
-                trade)
-            activities.append(activity)
-
-        existing_activities: list[GhostfolioImportActivity] = \
-            self.ghostfolio_api.get_all_activities_for_account(account_id)
-
-        diff: list[GhostfolioImportActivity] = get_diff(existing_activities, activities)
-        if envConf.is_debug_files_enabled():
-            debug_file_folder = envConf.file_write_location()
-            logger.warn("Flag WRITE_DEBUG_FILES is set, writing files")
-            with open(f"{debug_file_folder}activities_from_gf.json", 'w') as outfile:
-                logger.warn("WRITE_DEBUG_FILES: writing existing_activities")
-                json.dump(existing_activities, outfile)
-            with open(f"{debug_file_folder}activities_from_ib.json", 'w') as outfile:
-                logger.warn("WRITE_DEBUG_FILES: writing new activities")
-                json.dump(activities, outfile)
-            with open(f"{debug_file_folder}activities_diff.json", 'w') as outfile:
-                logger.warn("WRITE_DEBUG_FILES: writing new activities differences")
-                json.dump(diff, outfile)
-
-        if len(diff) == 0:
+    def apply_plan(self, plan: SyncPlan.SyncPlan) -> SyncPlan.ApplyResult:
+        """
+        Writes a plan of plan_sync to Ghostfolio: cash, trades, dividends and
+        the sync state. Activities synced since the plan was made are skipped,
+        a plan is not applied again once it or a later plan was applied.
+        """
+        if plan.ghost_host != self.ghostfolio_api.ghost_host:
+            logger.error(f"Plan was made for {plan.ghost_host}, "
+                         f"not for {self.ghostfolio_api.ghost_host}")
+            return SyncPlan.ApplyResult(False, False)
+        if plan.account_id is None:
+            with RunMetrics.span("account"):
+                account_id = self.ghostfolio_api.create_or_get_ibkr_account()['id']
+            if account_id == "":
+                logger.error("Failed to create the IBKR account, plan not applied")
+                return SyncPlan.ApplyResult(False, False)
+            plan = self.__for_account(plan, account_id)
+        sync_state = SyncState(self.ghostfolio_api.ghost_host, plan.account_id)
+        state = sync_state.load()
+        if sync_state.is_plan_outdated(state, plan.created):
+            logger.error(f"Plan made at {plan.created} not applied, a plan made at "
+                         f"{state.applied_plan} was applied already")
+            return SyncPlan.ApplyResult(True, False)
+        with RunMetrics.span("cash"):
+            if plan.cash is None:
+                logger.info("No cash set, no cash retrieved")
+            else:
+                self.set_cash_to_account(
+                    plan.account_id, plan.cash,
+                    self.ghostfolio_api.get_account(plan.account_id))
+        trades = self.__not_synced_since(state, plan, plan.trades, plan.trade_ids)
+        dividends = self.__not_synced_since(state, plan, plan.dividends,
+                                            plan.dividend_ids)
+
+        not_synced = set()
+        stopped = False
+        if len(trades) == 0:
             logger.info("Nothing new to sync (Buy/Sell)")
         else:
-            self.ghostfolio_api.import_activities(diff)
-            logger.info(f"Importet total {len(diff)} trades, "
-                        f"for symbols: {list(map(lambda x: x.symbol, diff))}")
-        # Sync dividends
-        import_dividends = []
-        for isin_to_import_dividends in self.ibkr_api.get_cash_transaction_isin(query):
-            activities = self.ghostfolio_api.get_dividends_to_import(
-                account_id,
-                isin_to_import_dividends,
-            )
-            if activities:
-                for activity in activities:
-                    import_dividends.append(activity)
-        if len(import_dividends) > 0:
-            self.ghostfolio_api.import_activities(import_dividends)
-            logger.info(
-                f"Imported total {len(import_dividends)} dividends, "
-                f"for symbols: {list(map(lambda x: x.symbol, import_dividends))}")
-        else:
+            with RunMetrics.span("import"):
+                import_result = self.ghostfolio_api.import_activities(
+                    [activity for activity, _ in trades])
+            RunMetrics.count("imported", len(import_result.imported))
+            RunMetrics.count("rejected", len(import_result.rejected))
+            RunMetrics.count("not_imported", len(import_result.not_imported))
+            not_synced |= self.__rejected_ids(trades, import_result)
+            stopped = len(import_result.not_imported) > 0
+            logger.info(f"Importet total {len(import_result.imported)} trades, "
+                        f"for symbols: "
+                        f"{list(map(lambda x: x.symbol, import_result.imported))}")
+        if len(dividends) == 0:
             logger.info("Nothing new to sync (Dividens)")
+        elif stopped:
+            logger.error("Import stopped, not importing dividends")
+            not_synced |= {transaction_id for _, transaction_id in dividends}
+        else:
+            with RunMetrics.span("dividends"):
+                import_result = self.ghostfolio_api.import_activities(
+                    [activity for activity, _ in dividends])
+            RunMetrics.count("dividends_imported", len(import_result.imported))
+            RunMetrics.count("rejected", len(import_result.rejected))
+            RunMetrics.count("not_imported", len(import_result.not_imported))
+            not_synced |= self.__rejected_ids(dividends, import_result)
+            stopped = len(import_result.not_imported) > 0
+            logger.info(
+                f"Imported total {len(import_result.imported)} dividends, "
+                f"for symbols: "
+                f"{list(map(lambda x: x.symbol, import_result.imported))}")
+        # remember what is in ghostfolio now, rejected activities are retried
+        synced_ids = {transaction_id: date
+                      for transaction_id, date in (list(plan.trade_dates.items())
+                                                   + list(plan.dividend_dates.items()))
+                      if transaction_id not in not_synced}
+        sync_state.save(state, synced_ids, plan.oldest_trade_date,
+                        plan.full_reconcile, plan.created)
+        self.ghostfolio_api.log_request_stats()
+        if plan.unresolved:
+            logger.error(f"No symbol found for {len(plan.unresolved)} instruments, "
+                         f"their trades were not synced: {plan.unresolved}")
+        return SyncPlan.ApplyResult(True, not stopped and not plan.unresolved)
 
-    def map_trade_to_gf(self, account_id, date_format,
-                        trade: Trade) -> GhostfolioImportActivity:
+    @staticmethod
+    def __for_account(plan, account_id):
+        """The plan of an account created by the apply, moved to account_id."""
+        return plan._replace(
+            account_id=account_id,
+            trades=[activity._replace(accountId=account_id)
+                    for activity in plan.trades],
+            dividends=[activity._replace(accountId=account_id)
+                       for activity in plan.dividends])
+
+    @staticmethod
+    def __not_synced_since(state, plan, activities, transaction_ids):
+        """(activity, id) pairs of the plan not in the sync state by now."""
+        pairs = list(zip(activities, transaction_ids))
+        if state is None or plan.full_reconcile:
+            return pairs
+        not_synced = [(activity, transaction_id) for activity, transaction_id in pairs
+                      if transaction_id not in state.transaction_ids]
+        if len(not_synced) < len(pairs):
+            logger.info(f"Skipping {len(pairs) - len(not_synced)} activities "
+                        f"synced since the plan was made")
+        return not_synced
+
+    @staticmethod
+    def __rejected_ids(pairs, import_result):
+        rejected = {id(rejected.activity) for rejected in import_result.rejected} \
+            | {id(activity) for activity in import_result.not_imported}
+        return {transaction_id for activity, transaction_id in pairs
+                if id(activity) in rejected}
+
+    def get_dividends_to_import(self, account_id, cash_transactions, tickers) -> \
+            DividendEngine.Dividends:
+        """Dividend activities and their date windows, built from the statement."""
+        with RunMetrics.span("dividends"):
+            dividends = DividendEngine.build_dividends(account_id, cash_transactions,
+                                                       tickers)
+        RunMetrics.count("dividends", len(dividends.activities))
+        return dividends
+
+    def map_trade_to_gf(self, account_id, date_format, trade: Trade,
+                        tickers: dict[tuple, GhostfolioTicker]) \
+            -> GhostfolioImportActivity:
         date = datetime.strptime(str(trade.tradeDate), date_format)
         iso_format = date.isoformat()
         symbol = self.map_symbol(trade)
         buy_sell = self.map_buy_sell(trade)
-        lookup_ticker: GhostfolioTicker = self. \
-            ghostfolio_api.get_ticker(trade.isin, symbol)
+        lookup_ticker: GhostfolioTicker = tickers.get((trade.isin, symbol))
+        if lookup_ticker is None:
+            raise Exception(f"no symbol found for {trade.isin} {symbol}")
         unit_price = float(trade.tradePrice)
         unit_currency = trade.currency
         fee = float(trade.taxes)
@@ -187,13 +430,18 @@ class SyncIBKR:
         return symbol
 
     def map_buy_sell(self, trade):
-        if trade.buySell == BuySell.BUY:
+        # by name, both parsers use ibflex's BuySell enum
+        if trade.buySell is not None and trade.buySell.name == "BUY":
             buy_sell = "BUY"
         else:
             buy_sell = "SELL"
         return buy_sell
 
-    def set_cash_to_account(self, account_id, cash):
+    def set_cash_to_account(self, account_id, cash, current=None):
+        """
+        Sets the balance of the account, a no-op if current, the account as
+        last known from the server, already has it.
+        """
         if cash == 0:
             logger.info("No cash set, no cash retrieved")
             return False
@@ -206,11 +454,13 @@ class SyncIBKR:
             "platformId": self.ghostfolio_api.ibkr_platform_id
         }
 
-        self.ghostfolio_api.update_account(account_id, account)
+        return self.ghostfolio_api.update_account(account_id, account, current)
 
     def delete_all_activities(self):
         account_id = self.ghostfolio_api.create_or_get_ibkr_account()['id']
         if account_id == "":
             logger.warning("Failed to retrieve account ID stopping now")
-            return
-        self.ghostfolio_api.delete_all_activities(account_id)
+            return False
+        # the next sync has to import everything again
+        SyncState(self.ghostfolio_api.ghost_host, account_id).clear()
+        return self.ghostfolio_api.delete_all_activities(account_id)
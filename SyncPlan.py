@@ -0,0 +1,113 @@
+import json
+import os
+from collections import namedtuple
+from datetime import datetime
+
+import LoggerFactory
+from GhostfolioApi import GhostfolioImportActivity
+from RunMetrics import write_atomically
+
+# bumped when the file format changes, older plans are refused
+PLAN_VERSION = 2
+
+logger = LoggerFactory.logger
+
+
+class SyncPlan(namedtuple('SyncPlan',
+                          'created ghost_host account_id full_reconcile '
+                          'current_cash cash trades trade_ids trade_dates '
+                          'oldest_trade_date dividends dividend_ids '
+                          'dividend_dates unresolved')):
+    """
+    Everything a sync would write, computed without writing anything.
+    account_id is None for an account that is created when applying.
+
+    trades are the activities to import, trade_ids their IBKR transactionIDs,
+    dividends and dividend_ids the same for dividends. trade_dates and
+    dividend_dates map every trade and dividend of the plan, already in
+    Ghostfolio or not, to its date, for the sync state saved after the import.
+    cash is the balance to set, None to leave it. unresolved are the
+    (isin, symbol) pairs without a Ghostfolio symbol, their trades are left
+    out and retried by the next sync.
+    """
+    __slots__ = ()
+
+    def cash_delta(self):
+        if self.cash is None:
+            return 0.0
+        return round(self.cash - float(self.current_cash or 0), 2)
+
+    def to_dict(self):
+        values = self._asdict()
+        values["version"] = PLAN_VERSION
+        values["cash_delta"] = self.cash_delta()
+        values["trades"] = [act._asdict() for act in self.trades]
+        values["dividends"] = [act._asdict() for act in self.dividends]
+        values["unresolved"] = [list(pair) for pair in self.unresolved]
+        return values
+
+    @staticmethod
+    def from_dict(values) -> 'SyncPlan':
+        if values.get("version") != PLAN_VERSION:
+            raise ValueError(f"unsupported plan version {values.get('version')}, "
+                             f"expected {PLAN_VERSION}")
+        return SyncPlan(
+            values["created"],
+            values["ghost_host"],
+            values["account_id"],
+            values["full_reconcile"],
+            values["current_cash"],
+            values["cash"],
+            [GhostfolioImportActivity(**act) for act in values["trades"]],
+            values["trade_ids"],
+            values["trade_dates"],
+            values["oldest_trade_date"],
+            [GhostfolioImportActivity(**act) for act in values["dividends"]],
+            values["dividend_ids"],
+            values["dividend_dates"],
+            [tuple(pair) for pair in values["unresolved"]],
+        )
+
+    def log_summary(self):
+        logger.info(f"Plan for account {self.account_id or '(not created yet)'}: "
+                    f"{len(self.trades)} trades, {len(self.dividends)} dividends "
+                    f"to import, cash {self.current_cash} -> {self.cash} "
+                    f"({self.cash_delta():+.2f})")
+        for isin, symbol in self.unresolved:
+            logger.warning(f"Plan: no symbol found for {isin} {symbol}, "
+                           f"its trades are not synced")
+
+
+class ApplyResult(namedtuple('ApplyResult', 'applied success')):
+    """
+    Whether the writes of a plan went out, by this or an earlier apply, and
+    whether all of them succeeded. An applied plan is not applied again, the
+    activities it failed to write are left to the next sync.
+    """
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.success
+
+
+def now():
+    # fine enough to order plans made in the same second
+    return datetime.now().isoformat(timespec='microseconds')
+
+
+def save(plan: SyncPlan, path):
+    write_atomically(path, json.dumps(plan.to_dict(), indent=2))
+    logger.info(f"Plan written to {path}")
+
+
+def load(path) -> SyncPlan:
+    with open(path) as infile:
+        return SyncPlan.from_dict(json.load(infile))
+
+
+def remove(path):
+    # an applied plan must not be applied a second time
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not remove applied plan {path}: {e}")
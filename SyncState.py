@@ -0,0 +1,67 @@
+from collections import namedtuple
+
+import CacheManager
+import LoggerFactory
+from EnvironmentConfiguration import EnvironmentConfiguration
+
+# applied_plan defaults for states saved before it was kept
+AccountSyncState = namedtuple('AccountSyncState',
+                              'transaction_ids last_trade_date runs_since_full '
+                              'applied_plan', defaults=(None,))
+
+envConf = EnvironmentConfiguration()
+cache = CacheManager.LazyCache("sync-state")
+logger = LoggerFactory.logger
+
+
+class SyncState:
+    """
+    Per account high-water mark of what was already synced to Ghostfolio.
+
+    transaction_ids maps every IBKR transactionID known to be in Ghostfolio
+    to its trade date, and every dividend, as dividend:<isin>:<pay date>, to
+    its pay date. last_trade_date is the newest of those dates. applied_plan
+    is when the last applied plan was made, older plans are not applied.
+    """
+
+    def __init__(self, ghost_host, account_id):
+        self.key = f"{ghost_host}|{account_id}"
+
+    def load(self) -> AccountSyncState:
+        return cache.get(self.key)
+
+    def is_full_reconcile_due(self, state: AccountSyncState) -> bool:
+        if state is None:
+            logger.info("No sync state found, running full reconcile")
+            return True
+        if state.runs_since_full + 1 >= envConf.full_reconcile_every():
+            logger.info(f"{state.runs_since_full} incremental runs since last "
+                        f"full reconcile, running full reconcile")
+            return True
+        return False
+
+    def is_plan_outdated(self, state: AccountSyncState, created) -> bool:
+        """Whether a plan made at created was applied, or a later one was."""
+        return state is not None and state.applied_plan is not None \
+            and created <= state.applied_plan
+
+    def save(self, state: AccountSyncState, transaction_ids: dict[str, str],
+             oldest_trade_date, full_reconcile: bool, applied_plan=None):
+        known = {} if state is None or full_reconcile \
+            else dict(state.transaction_ids)
+        known.update(transaction_ids)
+        # trades older than the flex window cannot show up again
+        if oldest_trade_date is not None:
+            known = {transaction_id: trade_date
+                     for transaction_id, trade_date in known.items()
+                     if trade_date >= oldest_trade_date}
+        last_trade_date = max(known.values(), default=None)
+        runs_since_full = 0 if full_reconcile or state is None \
+            else state.runs_since_full + 1
+        cache.set(self.key, AccountSyncState(known, last_trade_date, runs_since_full,
+                                             applied_plan))
+        logger.debug(f"saved sync state: {len(known)} transactions, "
+                     f"last trade {last_trade_date}")
+
+    def clear(self):
+        cache.delete(self.key)
@@ -0,0 +1,127 @@
+"""
+Micro-benchmark for the activity diff engine.
+
+Compares ActivityDiff.get_diff (indexed) against the previous linear scan
+(is_act_present per new activity) and checks both return the same diff.
+
+    python benchmarks/bench_diff.py [--size 10000] [--parity-size 2000] [--legacy]
+
+--legacy also times the linear scan at full size, which takes minutes at 10k.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from ActivityDiff import get_diff, is_act_present  # noqa: E402
+from GhostfolioApi import GhostfolioImportActivity  # noqa: E402
+
+ACCOUNT_ID = "b0e5b7b5-1f3a-4a57-8a3c-9d0d6a3d7e11"
+SYMBOLS = ["AAPL", "MSFT", "VWRL.L", "SHEL.L", "NESN.SW", "FRE.DE", "BNTX"]
+
+
+def make_activity(rnd: random.Random, n: int, comment_style: str):
+    if comment_style == "sync":
+        comment = f"<sync-trade-transactionID>{1000000 + n}</sync-trade-transactionID>"
+    elif comment_style == "user":
+        comment = f"manual entry {n}"
+    elif comment_style == "empty":
+        comment = ""
+    else:
+        comment = None
+    return GhostfolioImportActivity(
+        "USD",
+        "YAHOO",
+        f"2023-{1 + n % 12:02d}-{1 + n % 28:02d}T00:00:00",
+        round(rnd.uniform(0, 5), 2),
+        float(rnd.randint(1, 100)),
+        rnd.choice(SYMBOLS),
+        rnd.choice(["BUY", "SELL"]),
+        round(rnd.uniform(1, 500), 2),
+        ACCOUNT_ID,
+        comment,
+    )
+
+
+def make_dataset(size: int, seed: int = 42):
+    rnd = random.Random(seed)
+    existing = []
+    for n in range(size):
+        style = rnd.choices(["sync", "none", "user"], weights=[80, 15, 5])[0]
+        existing.append(make_activity(rnd, n, style))
+    new = []
+    for n in range(size):
+        roll = rnd.random()
+        if roll < 0.5:
+            # already synced, matched by comment
+            new.append(make_activity(rnd, n, "sync"))
+        elif roll < 0.6:
+            # same trade entered without comment, matched by fields
+            act = existing[rnd.randrange(size)]
+            new.append(act._replace(
+                comment=f"<sync-trade-transactionID>{9000000 + n}"
+                        f"</sync-trade-transactionID>",
+                date=act.date + ".000Z"))
+        else:
+            new.append(make_activity(rnd, size + n, "sync"))
+    return existing, new
+
+
+def legacy_diff(existing, new):
+    return [act for act in new if not is_act_present(act, existing)]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def check_parity(size: int):
+    existing, new = make_dataset(size, seed=7)
+    # an empty comment is a prefix of everything, keep that edge covered
+    existing_with_empty = existing + [make_activity(random.Random(1), 0, "empty")]
+    for existing_acts in (existing, existing_with_empty, []):
+        expected = legacy_diff(existing_acts, new)
+        actual = get_diff(existing_acts, new)
+        if expected != actual:
+            raise AssertionError(
+                f"parity mismatch: legacy {len(expected)} vs indexed {len(actual)}")
+    print(f"parity ok at {size} x {size}")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--size", type=int, default=10000)
+    arg_parser.add_argument("--parity-size", type=int, default=2000)
+    arg_parser.add_argument("--legacy", action="store_true")
+    args = arg_parser.parse_args()
+
+    check_parity(args.parity_size)
+
+    # memory traced on a separate pass, tracing slows down the timed one
+    tracemalloc.start()
+    existing, new = make_dataset(args.size)
+    dataset_size = tracemalloc.get_traced_memory()[0]
+    get_diff(existing, new)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    diff, elapsed = timed(get_diff, existing, new)
+    print(f"indexed get_diff {args.size} x {args.size}: "
+          f"{elapsed * 1000:.1f} ms, {len(diff)} new, "
+          f"activities {dataset_size / 2 ** 20:.1f} MiB, "
+          f"peak {peak / 2 ** 20:.1f} MiB")
+    if args.legacy:
+        legacy, legacy_elapsed = timed(legacy_diff, existing, new)
+        assert legacy == diff
+        print(f"linear scan      {args.size} x {args.size}: "
+              f"{legacy_elapsed * 1000:.1f} ms, {len(legacy)} new "
+              f"({legacy_elapsed / elapsed:.0f}x slower)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark of the full ibflex parse against the streaming parser.
+
+Both parse the same synthetic statement; the script checks they yield the
+same stock trades, cash transactions and cash, and reports wall time and
+peak traced memory of each.
+
+    python benchmarks/bench_flex_parse.py [--trades 1000 10000 50000]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from ibflex import parser  # noqa: E402
+
+import FlexStream  # noqa: E402
+from IbkrApi import IbkrApi  # noqa: E402
+from SyncIBKR import get_cash_amount_from_flex  # noqa: E402
+from synthetic_flex import make_flex_statement  # noqa: E402
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def extract(query):
+    return (IbkrApi.get_stock_transactions(query),
+            IbkrApi.get_cash_transactions(query),
+            get_cash_amount_from_flex(query))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--trades", type=int, nargs="+",
+                            default=[1000, 10000, 50000])
+    args = arg_parser.parse_args()
+
+    for trade_count in args.trades:
+        statement = make_flex_statement(trade_count)
+        full, full_time, full_peak = measure(parser.parse, statement)
+        streamed, stream_time, stream_peak = measure(FlexStream.parse_stream,
+                                                     statement)
+        if extract(full) != extract(streamed):
+            raise AssertionError(f"stream parse differs at {trade_count} trades")
+        del full, streamed
+        print(f"{trade_count:>7} trades ({len(statement) / 2 ** 20:.1f} MiB xml): "
+              f"full {full_time:.2f}s / {full_peak / 2 ** 20:.1f} MiB peak, "
+              f"stream {stream_time:.2f}s / {stream_peak / 2 ** 20:.1f} MiB peak")
+
+
+if __name__ == '__main__':
+    main()
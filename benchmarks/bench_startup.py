@@ -0,0 +1,143 @@
+"""
+Cold start benchmark of main.py.
+
+Measures, each as the median of a few fresh processes:
+- import time: cumulative -X importtime of "import main"
+- time to first request: from starting main.py until the fake servers (see
+  fake_servers.py) receive its first request, with an empty
+  FILE_WRITE_LOCATION so no cache helps
+- interpreter: python -c pass, the floor of both
+
+    python benchmarks/bench_startup.py [--runs 5] [--output results.json]
+        [--import-budget 300] [--first-request-budget 400]
+
+Exits with 1 if a median exceeds its budget (milliseconds).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIR = os.path.abspath(os.path.join(BENCHMARK_DIR, os.pardir))
+FAKE_SERVERS = os.path.join(BENCHMARK_DIR, "fake_servers.py")
+MAIN = os.path.join(REPOSITORY_DIR, "main.py")
+
+
+def sync_env(urls, workdir):
+    env = dict(os.environ)
+    env.update({
+        "GHOST_TOKEN": "benchmark-token",
+        "IBKR_TOKEN": "benchmark-token",
+        "IBKR_QUERY": "benchmark-query",
+        "GHOST_HOST": urls["ghostfolio"] if urls else "http://127.0.0.1:9",
+        "IBKR_FLEX_URL": urls["flex"] if urls else "",
+        "FILE_WRITE_LOCATION": workdir,
+        "SYMBOL_INDEX_FILE": os.path.join(workdir, "symbol-index.json"),
+        "LOG_LEVEL": "WARNING",
+        "WRITE_DEBUG_FILES": "",
+        "GHOST_RATE_LIMIT": "0",
+    })
+    return env
+
+
+def measure_interpreter():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def measure_import(workdir):
+    """Cumulative import time of main in milliseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=REPOSITORY_DIR, env=sync_env(None, workdir),
+        stderr=subprocess.PIPE, text=True, check=True)
+    for line in reversed(result.stderr.splitlines()):
+        # import time: self [us] | cumulative | imported package
+        columns = [column.strip() for column in line.split("|")]
+        if len(columns) == 3 and columns[2] == "main":
+            return int(columns[1]) / 1000
+    raise RuntimeError(f"no import time for main in:\n{result.stderr}")
+
+
+def measure_first_request(urls, workdir):
+    """Milliseconds from starting main.py to the first request it sends."""
+    start = time.time()
+    subprocess.run([sys.executable, MAIN], cwd=workdir, env=sync_env(urls, workdir),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    timestamps = [timestamp for timestamp, _ in
+                  requests.get(f"{urls['ghostfolio']}/__requests").json()
+                  if timestamp >= start]
+    if not timestamps:
+        raise RuntimeError("main.py did not send any request")
+    return (min(timestamps) - start) * 1000
+
+
+def run(runs, trades):
+    server = subprocess.Popen([sys.executable, FAKE_SERVERS, "--trades", str(trades)],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        urls = json.loads(server.stdout.readline())
+        measurements = {"interpreter_ms": [], "import_ms": [], "first_request_ms": []}
+        for _ in range(runs):
+            workdir = tempfile.mkdtemp(prefix="ghostfolio-sync-startup-")
+            try:
+                measurements["interpreter_ms"].append(measure_interpreter())
+                measurements["import_ms"].append(measure_import(workdir))
+                measurements["first_request_ms"].append(
+                    measure_first_request(urls, workdir))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        return {name: round(statistics.median(values), 1)
+                for name, values in measurements.items()}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--trades", type=int, default=100,
+                            help="trades in the fake statement")
+    arg_parser.add_argument("--output", help="write the results as json")
+    arg_parser.add_argument("--import-budget", type=float, default=300,
+                            help="milliseconds allowed to import main")
+    arg_parser.add_argument("--first-request-budget", type=float, default=400,
+                            help="milliseconds allowed until the first request")
+    args = arg_parser.parse_args()
+
+    results = run(args.runs, args.trades)
+    for name, value in results.items():
+        print(f"{name:<18} {value:8.1f}")
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, outfile, indent=2)
+    over_budget = [f"{name} {results[name]:.1f}ms > {budget:g}ms"
+                   for name, budget in (("import_ms", args.import_budget),
+                                        ("first_request_ms",
+                                         args.first_request_budget))
+                   if results[name] > budget]
+    for message in over_budget:
+        print(f"OVER BUDGET {message}")
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+"""
+End to end benchmark of sync_ibkr against local fake servers.
+
+For each statement size a worker process syncs three times against a fresh
+fake Ghostfolio (see fake_servers.py): an initial sync into an empty
+account, a full reconcile and an incremental sync with nothing new. Each
+run reports wall time, requests per endpoint and peak RSS per phase
+(download, parse, map, diff, import, dividends, other). With SYNC_PIPELINE
+(the default) phases overlap, so they can add up to more than the wall
+time; SYNC_PIPELINE=FALSE attributes time and requests one phase at a time.
+
+    python benchmarks/bench_sync.py [--trades 1000 10000 100000]
+        [--latency 2] [--flex-latency 2000] [--output results.json]
+        [--baseline old.json [--tolerance 1.25]]
+
+With --baseline, phases that got slower than tolerance times the baseline,
+or that send more requests, are reported and the script exits with 1.
+"""
+import argparse
+import bisect
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_SERVERS = os.path.join(BENCHMARK_DIR, "fake_servers.py")
+PHASES = ["download", "parse", "map", "diff", "import", "dividends", "other"]
+RUNS = ["initial", "reconcile", "incremental"]
+# calls closer than this are merged into one interval of their phase
+MERGE_GAP = 0.05
+RSS_SAMPLE_INTERVAL = 0.005
+# phases faster than this in the baseline are too noisy to compare
+MIN_COMPARED_SECONDS = 0.05
+
+
+def current_rss():
+    """Resident set size in bytes, None where /proc is not available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class PhaseRecorder:
+    """
+    Times wrapped calls per phase and keeps the intervals in which each phase
+    ran, to attribute server requests and RSS samples to phases afterwards.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.seconds = defaultdict(float)
+            # [phase, start, end], sorted by start
+            self.intervals = []
+
+    def wrap(self, owner, name, phase):
+        """
+        Replaces owner.name by a wrapper timing it as phase, or as
+        phase(*args) for a callable called with the arguments of the call.
+        """
+        original = getattr(owner, name)
+
+        def wrapper(*args, **kwargs):
+            start = time.time()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(phase(*args) if callable(phase) else phase,
+                            start, time.time())
+
+        setattr(owner, name, wrapper)
+
+    def record(self, phase, start, end):
+        with self.lock:
+            self.seconds[phase] += end - start
+            last = self.intervals[-1] if self.intervals else None
+            if last is not None and last[0] == phase and start - last[2] < MERGE_GAP:
+                last[2] = max(last[2], end)
+            else:
+                self.intervals.append([phase, start, end])
+
+    def phase_at(self, timestamp):
+        starts = [interval[1] for interval in self.intervals]
+        i = bisect.bisect_right(starts, timestamp) - 1
+        if i >= 0 and timestamp <= self.intervals[i][2]:
+            return self.intervals[i][0]
+        return "other"
+
+
+class RssSampler(threading.Thread):
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(RSS_SAMPLE_INTERVAL):
+            rss = current_rss()
+            if rss is not None:
+                self.samples.append((time.time(), rss))
+
+    def peaks(self, recorder: PhaseRecorder, start, end):
+        peaks = {}
+        for timestamp, rss in self.samples:
+            if start <= timestamp <= end:
+                phase = recorder.phase_at(timestamp)
+                peaks[phase] = max(peaks.get(phase, 0), rss)
+        return peaks
+
+
+def start_fake_servers(trades, latency, flex_latency):
+    process = subprocess.Popen(
+        [sys.executable, FAKE_SERVERS, "--trades", str(trades),
+         "--latency", str(latency)]
+        + ([] if flex_latency is None else ["--flex-latency", str(flex_latency)]),
+        stdout=subprocess.PIPE, text=True)
+    return process, json.loads(process.stdout.readline())
+
+
+def run_worker(trades, latency, flex_latency):
+    """Runs the syncs of one statement size, returns their results."""
+    workdir = tempfile.mkdtemp(prefix="ghostfolio-sync-bench-")
+    server, urls = start_fake_servers(trades, latency, flex_latency)
+    try:
+        # the modules read their configuration on import
+        os.environ.update({
+            "FILE_WRITE_LOCATION": workdir,
+            "IBKR_FLEX_URL": urls["flex"],
+            "SYMBOL_INDEX_FILE": os.path.join(workdir, "symbol-index.json"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            "WRITE_DEBUG_FILES": "",
+            # measure the sync, not the throttling meant for real servers
+            "GHOST_RATE_LIMIT": os.environ.get("GHOST_RATE_LIMIT", "0"),
+        })
+        sys.path.insert(0, os.path.join(BENCHMARK_DIR, os.pardir))
+        import FlexStream
+        import SyncIBKR
+        from GhostfolioApi import GhostfolioConfig
+        from IbkrApi import IbkrConfig
+        from fake_servers import ACCOUNT_NAME, PLATFORM
+
+        sync = SyncIBKR.SyncIBKR(
+            IbkrConfig("benchmark-token", "benchmark-query"),
+            GhostfolioConfig("benchmark-token", urls["ghostfolio"], "USD",
+                             ACCOUNT_NAME, PLATFORM["id"], PLATFORM["name"]))
+        recorder = PhaseRecorder()
+        recorder.wrap(sync.ibkr_api, "download_query", "download")
+        recorder.wrap(sync.ibkr_api, "parse_query", "parse")
+        recorder.wrap(FlexStream, "to_columns", "parse")
+        recorder.wrap(FlexStream, "from_columns", "parse")
+        recorder.wrap(sync.ibkr_api, "get_stock_transactions", "map")
+        recorder.wrap(sync.ghostfolio_api, "resolve_tickers", "map")
+        recorder.wrap(sync, "map_trade_to_gf", "map")
+        recorder.wrap(SyncIBKR, "get_diff", "diff")
+        recorder.wrap(sync, "get_dividends_to_import", "dividends")
+        recorder.wrap(sync.ghostfolio_api, "import_activities",
+                      lambda bulk: "dividends"
+                      if bulk and bulk[0].type == "DIVIDEND" else "import")
+        sampler = RssSampler()
+        sampler.start()
+
+        results = []
+        for run in RUNS:
+            recorder.reset()
+            start = time.time()
+            success = sync.sync_ibkr(full_reconcile=run == "reconcile")
+            end = time.time()
+            request_log = [(timestamp, endpoint) for timestamp, endpoint
+                           in requests.get(f"{urls['ghostfolio']}/__requests").json()
+                           if start <= timestamp <= end]
+            phase_requests = defaultdict(lambda: defaultdict(int))
+            for timestamp, endpoint in request_log:
+                phase_requests[recorder.phase_at(timestamp)][endpoint] += 1
+            peaks = sampler.peaks(recorder, start, end)
+            phases = {}
+            for phase in PHASES:
+                seconds = recorder.seconds.get(phase, 0.0)
+                if phase == "other":
+                    seconds = (end - start) - sum(recorder.seconds.values())
+                phases[phase] = {
+                    "seconds": round(max(0.0, seconds), 4),
+                    "requests": dict(sorted(phase_requests[phase].items())),
+                    "peak_rss_mb": round(peaks[phase] / 2 ** 20, 1)
+                    if phase in peaks else None,
+                }
+            results.append({
+                "trades": trades,
+                "run": run,
+                "success": bool(success),
+                "seconds": round(end - start, 4),
+                "requests": len(request_log),
+                # peak of the whole process so far, also where /proc is missing
+                "max_rss_mb": round(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                "phases": phases,
+            })
+        sampler.stopped.set()
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results):
+    for result in results:
+        print(f"{result['trades']:>7} trades {result['run']:<12} "
+              f"{'OK' if result['success'] else 'FAILED':<6} "
+              f"{result['seconds']:8.2f}s {result['requests']:6} requests")
+        for phase, values in result["phases"].items():
+            requests_count = sum(values["requests"].values())
+            rss = values["peak_rss_mb"]
+            print(f"    {phase:<10} {values['seconds']:8.3f}s "
+                  f"{requests_count:6} requests "
+                  f"{'' if rss is None else f'{rss:8.1f} MiB peak'}")
+
+
+def compare(results, baseline, tolerance):
+    """Returns the regressions of results against a baseline result file."""
+    baseline_runs = {(result["trades"], result["run"]): result
+                     for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = baseline_runs.get((result["trades"], result["run"]))
+        if old is None:
+            continue
+        for phase, values in result["phases"].items():
+            old_values = old["phases"].get(phase)
+            if old_values is None:
+                continue
+            label = f"{result['trades']} trades {result['run']} {phase}"
+            if old_values["seconds"] >= MIN_COMPARED_SECONDS \
+                    and values["seconds"] > old_values["seconds"] * tolerance:
+                regressions.append(f"{label}: {old_values['seconds']:.3f}s -> "
+                                   f"{values['seconds']:.3f}s")
+            old_count = sum(old_values["requests"].values())
+            new_count = sum(values["requests"].values())
+            if new_count > old_count:
+                regressions.append(f"{label}: {old_count} -> {new_count} requests")
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--trades", type=int, nargs="+",
+                            default=[1000, 10000, 100000])
+    arg_parser.add_argument("--latency", type=float, default=0,
+                            help="milliseconds the fake servers add per request")
+    arg_parser.add_argument("--flex-latency", type=float,
+                            help="milliseconds the fake flex server adds instead")
+    arg_parser.add_argument("--output", help="write the results as json")
+    arg_parser.add_argument("--baseline", help="results json to compare with")
+    arg_parser.add_argument("--tolerance", type=float, default=1.25)
+    arg_parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_worker(args.worker, args.latency, args.flex_latency)))
+        return
+
+    results = []
+    for trades in args.trades:
+        # a process per size, the modules keep caches and read env on import
+        worker = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(trades),
+             "--latency", str(args.latency)]
+            + ([] if args.flex_latency is None
+               else ["--flex-latency", str(args.flex_latency)]),
+            stdout=subprocess.PIPE, text=True, check=True)
+        results.extend(json.loads(worker.stdout.splitlines()[-1]))
+    print_results(results)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency_ms": args.latency,
+        "flex_latency_ms": args.flex_latency,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+    if args.baseline:
+        with open(args.baseline) as infile:
+            regressions = compare(results, json.load(infile), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
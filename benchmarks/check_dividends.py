@@ -0,0 +1,126 @@
+"""
+End to end check of the dividend matching against local fake servers.
+
+Each case plans a sync without sync state (so a full reconcile) into a new
+account of the fake Ghostfolio (see fake_servers.py) holding dividends:
+- empty: no dividends yet, every dividend of the statement is planned
+- legacy: dividends as imported by Ghostfolio's dividend import, dated on
+  the ex-date (in UTC) with other quantities and prices and no comment
+- synced: dividends imported by the sync, with their sync comment but
+  stored a day earlier, as a time zone shift would
+
+    python benchmarks/check_dividends.py [--trades 1000]
+
+Exits with 1 if a case plans other dividends than expected.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import date, timedelta
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_SERVERS = os.path.join(BENCHMARK_DIR, "fake_servers.py")
+
+
+def start_fake_servers(trades):
+    process = subprocess.Popen([sys.executable, FAKE_SERVERS, "--trades", str(trades)],
+                               stdout=subprocess.PIPE, text=True)
+    return process, json.loads(process.stdout.readline())
+
+
+def utc_day_before(day):
+    """Local midnight of day as stored in UTC east of Greenwich."""
+    return f"{day - timedelta(days=1)}T22:00:00.000Z"
+
+
+def existing_dividends(case, account_id, cash_transactions, tickers):
+    """The dividends Ghostfolio holds before the planned sync."""
+    import DividendEngine
+    from GhostfolioApi import GhostfolioImportActivity
+
+    if case == "synced":
+        dividends = DividendEngine.build_dividends(account_id, cash_transactions,
+                                                   tickers)
+        return [activity._replace(date=utc_day_before(
+                    date.fromisoformat(activity.date[0:10])))
+                for activity in dividends.activities.values()]
+    if case == "legacy":
+        return [GhostfolioImportActivity(
+                    ticker.currency, ticker.data_source,
+                    utc_day_before(payment.ex_date), 0, 10, ticker.symbol,
+                    DividendEngine.DIVIDEND, 0.5, account_id, None)
+                for payment, ticker in (
+                    (payment, tickers.get((payment.isin, None)))
+                    for payment in DividendEngine.group_payments(cash_transactions))
+                if ticker is not None and payment.net > 0]
+    return []
+
+
+def run_case(case, urls):
+    """(dividends planned, dividends expected)"""
+    import SyncIBKR
+    from GhostfolioApi import GhostfolioConfig
+    from IbkrApi import IbkrConfig
+    from fake_servers import PLATFORM
+
+    # an account per case, so sync state and orders start empty
+    sync = SyncIBKR.SyncIBKR(
+        IbkrConfig("benchmark-token", "benchmark-query"),
+        GhostfolioConfig("benchmark-token", urls["ghostfolio"], "USD",
+                         f"IBKR-{case}", PLATFORM["id"], PLATFORM["name"]))
+    account_id = sync.ghostfolio_api.create_or_get_ibkr_account()['id']
+    cash_transactions = sync.ibkr_api.get_cash_transactions(
+        sync.ibkr_api.get_and_parse_query())
+    tickers = sync.ghostfolio_api.resolve_tickers(
+        {(cash_transaction.isin, None) for cash_transaction in cash_transactions})
+    existing = existing_dividends(case, account_id, cash_transactions, tickers)
+    if existing:
+        sync.ghostfolio_api.import_activities(existing)
+    plan = sync.plan_sync()
+    expected = len(sync.get_dividends_to_import(account_id, cash_transactions,
+                                                tickers).activities) \
+        if case == "empty" else 0
+    return len(plan.dividends), expected
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--trades", type=int, default=1000,
+                            help="trades in the fake statement")
+    args = arg_parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ghostfolio-sync-check-")
+    server, urls = start_fake_servers(args.trades)
+    try:
+        # the modules read their configuration on import
+        os.environ.update({
+            "FILE_WRITE_LOCATION": workdir,
+            "IBKR_FLEX_URL": urls["flex"],
+            "SYMBOL_INDEX_FILE": os.path.join(workdir, "symbol-index.json"),
+            "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+            "WRITE_DEBUG_FILES": "",
+            "GHOST_RATE_LIMIT": "0",
+        })
+        sys.path.insert(0, os.path.join(BENCHMARK_DIR, os.pardir))
+        failed = []
+        for case in ("empty", "legacy", "synced"):
+            planned, expected = run_case(case, urls)
+            ok = planned == expected and (case != "empty" or planned > 0)
+            print(f"{case:<8} {'OK' if ok else 'FAILED':<7} "
+                  f"{planned} dividends planned, {expected} expected")
+            if not ok:
+                failed.append(case)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
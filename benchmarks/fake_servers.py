@@ -0,0 +1,308 @@
+"""
+Local stand-ins for Ghostfolio and the IBKR Flex Web Service.
+
+Implements just enough of both APIs for a sync: accounts, platforms, user
+settings, paged orders, imports, symbol lookup and dividends on the
+Ghostfolio side, the two step statement download on the Flex side. Every
+request is logged with its timestamp, GET /__requests returns the log.
+
+    python benchmarks/fake_servers.py [--trades 10000] [--latency 5]
+        [--flex-latency 2000]
+
+prints the urls of both servers and serves until stopped.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic_flex import INSTRUMENTS, make_flex_statement  # noqa: E402
+
+ACCOUNT_ID = "benchmark-account"
+ACCOUNT_NAME = "IBKR"
+PLATFORM = {"id": "benchmark-platform", "name": "Interactive Brokers"}
+DIVIDENDS_PER_SYMBOL = 20
+FLEX_REFERENCE_CODE = "1234567890"
+
+# path patterns, the name is the endpoint the request is counted for
+GHOSTFOLIO_ROUTES = [
+    ("GET", re.compile(r"/api/v1/info"), "info"),
+    ("GET", re.compile(r"/api/v1/user"), "user"),
+    ("PUT", re.compile(r"/api/v1/user/setting"), "user_setting"),
+    ("GET", re.compile(r"/api/v1/account"), "accounts"),
+    ("POST", re.compile(r"/api/v1/account"), "create_account"),
+    ("PUT", re.compile(r"/api/v1/account/(?P<id>[^/]+)"), "update_account"),
+    ("GET", re.compile(r"/api/v1/order"), "orders"),
+    ("POST", re.compile(r"/api/v1/order"), "create_order"),
+    ("DELETE", re.compile(r"/api/v1/order/(?P<id>[^/]+)"), "delete_order"),
+    ("POST", re.compile(r"/api/v1/import"), "import"),
+    ("GET", re.compile(r"/api/v1/symbol/lookup"), "lookup"),
+    ("GET", re.compile(r"/api/v1/import/dividends/(?P<data_source>[^/]+)/"
+                       r"(?P<symbol>[^/]+)"), "dividends"),
+    ("GET", re.compile(r"/__requests"), None),
+]
+FLEX_ROUTES = [
+    ("GET", re.compile(r"/SendRequest"), "flex_send_request"),
+    ("GET", re.compile(r"/GetStatement"), "flex_get_statement"),
+]
+
+
+class FakeState:
+    """Orders, accounts and the request log, shared by both servers."""
+
+    def __init__(self, statement: bytes, latency: float, flex_latency=None):
+        self.statement = statement
+        self.latency = latency
+        # the Flex Web Service takes seconds to generate a statement
+        self.flex_latency = latency if flex_latency is None else flex_latency
+        self.lock = threading.Lock()
+        self.accounts = [{"id": ACCOUNT_ID, "name": ACCOUNT_NAME, "balance": 0,
+                          "currency": "USD", "isExcluded": False,
+                          "platformId": PLATFORM["id"]}]
+        # account id -> orders, in import order
+        self.orders = {}
+        # (data source, symbol, date) of imported dividends
+        self.dividend_keys = set()
+        self.requests = []
+
+    def log(self, endpoint):
+        with self.lock:
+            self.requests.append((time.time(), endpoint))
+
+
+def make_handler(state: FakeState, routes, handlers, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately, without this every
+        # keep-alive response waits for the delayed ack of the client
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_POST(self):
+            self.dispatch("POST")
+
+        def do_PUT(self):
+            self.dispatch("PUT")
+
+        def do_DELETE(self):
+            self.dispatch("DELETE")
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            for route_method, pattern, endpoint in routes:
+                match = pattern.fullmatch(url.path)
+                if route_method == method and match:
+                    if endpoint is None:
+                        return self.send(200, state.requests)
+                    state.log(endpoint)
+                    if latency:
+                        time.sleep(latency)
+                    query = {key: values[0]
+                             for key, values in parse_qs(url.query).items()}
+                    return handlers[endpoint](self, match.groupdict(), query, body)
+            self.send(404, {"error": f"no route for {method} {url.path}"})
+
+        def send(self, status, content, content_type="application/json"):
+            data = content if isinstance(content, bytes) \
+                else json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def ghostfolio_handlers(state: FakeState):
+    profiles = {}
+    for symbol, isin, currency in INSTRUMENTS:
+        profile = {"dataSource": "YAHOO", "symbol": symbol, "currency": currency}
+        profiles[isin] = profiles[symbol] = profile
+
+    def to_order(activity):
+        return {
+            "id": str(uuid.uuid4()),
+            "accountId": activity["accountId"],
+            "date": activity["date"],
+            "fee": activity["fee"],
+            "quantity": activity["quantity"],
+            "type": activity["type"],
+            "unitPrice": activity["unitPrice"],
+            "comment": activity.get("comment"),
+            "SymbolProfile": {"dataSource": activity["dataSource"],
+                              "symbol": activity["symbol"],
+                              "currency": activity["currency"]},
+        }
+
+    def info(handler, params, query, body):
+        handler.send(200, {"platforms": [PLATFORM]})
+
+    def user(handler, params, query, body):
+        handler.send(200, {"settings": {}})
+
+    def user_setting(handler, params, query, body):
+        handler.send(200, {})
+
+    def accounts(handler, params, query, body):
+        handler.send(200, {"accounts": state.accounts})
+
+    def create_account(handler, params, query, body):
+        account = dict(json.loads(body), id=str(uuid.uuid4()))
+        with state.lock:
+            state.accounts.append(account)
+        handler.send(201, account)
+
+    def update_account(handler, params, query, body):
+        account = dict(json.loads(body), id=params["id"])
+        with state.lock:
+            state.accounts = [{**known, **account} if known["id"] == account["id"]
+                              else known for known in state.accounts]
+        handler.send(200, account)
+
+    def orders(handler, params, query, body):
+        with state.lock:
+            if "accounts" in query:
+                selected = state.orders.get(query["accounts"], [])
+            else:
+                selected = [order for account_orders in state.orders.values()
+                            for order in account_orders]
+        skip = int(query.get("skip", 0))
+        take = int(query["take"]) if "take" in query else len(selected)
+        handler.send(200, {"activities": selected[skip:skip + take],
+                           "count": len(selected)})
+
+    def create_order(handler, params, query, body):
+        order = to_order(json.loads(body))
+        with state.lock:
+            state.orders.setdefault(order["accountId"], []).append(order)
+        handler.send(201, order)
+
+    def delete_order(handler, params, query, body):
+        with state.lock:
+            state.orders = {account_id: [order for order in account_orders
+                                         if order["id"] != params["id"]]
+                            for account_id, account_orders in state.orders.items()}
+        handler.send(200, {"id": params["id"]})
+
+    def import_activities(handler, params, query, body):
+        activities = json.loads(body)["activities"]
+        new_orders = [to_order(activity) for activity in activities]
+        with state.lock:
+            for order in new_orders:
+                state.orders.setdefault(order["accountId"], []).append(order)
+            for activity in activities:
+                if activity["type"] == "DIVIDEND":
+                    state.dividend_keys.add((activity["dataSource"],
+                                             activity["symbol"], activity["date"]))
+        handler.send(201, {"activities": new_orders})
+
+    def lookup(handler, params, query, body):
+        profile = profiles.get(query.get("query"))
+        handler.send(200, {"items": [profile] if profile else []})
+
+    def dividends(handler, params, query, body):
+        activities = []
+        for year in range(DIVIDENDS_PER_SYMBOL):
+            date = datetime(2000 + year, 6, 15).isoformat() + ".000Z"
+            if (params["data_source"], params["symbol"], date) \
+                    in state.dividend_keys:
+                continue
+            activities.append({
+                "accountId": ACCOUNT_ID,
+                "date": date,
+                "fee": 0,
+                "quantity": 10,
+                "type": "DIVIDEND",
+                "unitPrice": 0.5,
+                "SymbolProfile": {"dataSource": params["data_source"],
+                                  "symbol": params["symbol"],
+                                  "currency": "USD"},
+            })
+        handler.send(200, {"activities": activities})
+
+    return {
+        "info": info,
+        "user": user,
+        "user_setting": user_setting,
+        "accounts": accounts,
+        "create_account": create_account,
+        "update_account": update_account,
+        "orders": orders,
+        "create_order": create_order,
+        "delete_order": delete_order,
+        "import": import_activities,
+        "lookup": lookup,
+        "dividends": dividends,
+    }
+
+
+def flex_handlers(state: FakeState, flex_url):
+    def send_request(handler, params, query, body):
+        timestamp = datetime.now().strftime("%d %B, %Y %I:%M %p") + " EST"
+        handler.send(200, (
+            f'<FlexStatementResponse timestamp="{timestamp}">'
+            f"<Status>Success</Status>"
+            f"<ReferenceCode>{FLEX_REFERENCE_CODE}</ReferenceCode>"
+            f"<Url>{flex_url}/GetStatement</Url>"
+            f"</FlexStatementResponse>").encode(), "text/xml")
+
+    def get_statement(handler, params, query, body):
+        handler.send(200, state.statement, "text/xml")
+
+    return {"flex_send_request": send_request, "flex_get_statement": get_statement}
+
+
+def start_servers(state: FakeState):
+    """Starts both servers on free ports, returns (ghostfolio url, flex url)."""
+    ghostfolio = ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        make_handler(state, GHOSTFOLIO_ROUTES, ghostfolio_handlers(state),
+                     state.latency))
+    flex = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+    flex_url = f"http://127.0.0.1:{flex.server_port}"
+    flex.RequestHandlerClass = make_handler(state, FLEX_ROUTES,
+                                            flex_handlers(state, flex_url),
+                                            state.flex_latency)
+    for server in (ghostfolio, flex):
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{ghostfolio.server_port}", flex_url
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--trades", type=int, default=10000)
+    arg_parser.add_argument("--seed", type=int, default=1)
+    arg_parser.add_argument("--latency", type=float, default=0,
+                            help="milliseconds added to every request")
+    arg_parser.add_argument("--flex-latency", type=float,
+                            help="milliseconds added to flex requests instead")
+    args = arg_parser.parse_args()
+    state = FakeState(make_flex_statement(args.trades, args.seed),
+                      args.latency / 1000,
+                      None if args.flex_latency is None else args.flex_latency / 1000)
+    ghostfolio_url, flex_url = start_servers(state)
+    print(json.dumps({"ghostfolio": ghostfolio_url,
+                      "flex": f"{flex_url}/SendRequest"}), flush=True)
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Synthetic Flex statements for the benchmarks.
+
+Trades are a mix of stocks, options and FX, with dividend and withholding tax
+cash transactions for the stock positions, similar to a multi-year activity
+statement.
+"""
+import random
+from datetime import date, timedelta
+from xml.sax.saxutils import quoteattr
+
+INSTRUMENTS = [
+    ("AAPL", "US0378331005", "USD"),
+    ("MSFT", "US5949181045", "USD"),
+    ("VWRL", "IE00B3RBWM25", "GBP"),
+    ("SHEL", "GB00BP6MXD84", "GBP"),
+    ("NESN", "CH0038863350", "CHF"),
+    ("FRE", "DE0005785604", "EUR"),
+    ("BNTX", "US09075V1026", "USD"),
+    ("ASML", "NL0010273215", "EUR"),
+]
+ACCOUNT_ID = "U1234567"
+START_DATE = date(2019, 1, 2)
+
+
+def element(tag, attributes):
+    return f"<{tag} " + " ".join(f"{key}={quoteattr(str(value))}"
+                                 for key, value in attributes.items()) + " />"
+
+
+def make_trade(rnd: random.Random, n: int):
+    symbol, isin, currency = rnd.choice(INSTRUMENTS)
+    category = rnd.choices(["STK", "OPT", "CASH"], weights=[70, 20, 10])[0]
+    if category == "CASH":
+        symbol, isin, currency = "EUR.USD", "", "USD"
+    elif category == "OPT":
+        symbol, isin = f"{symbol} 240119C00150000", ""
+    trade_date = START_DATE + timedelta(days=n % 1800)
+    quantity = rnd.randint(1, 200)
+    buy_sell = rnd.choice(["BUY", "SELL"])
+    price = round(rnd.uniform(5, 500), 4)
+    return element("Trade", {
+        "accountId": ACCOUNT_ID,
+        "currency": currency,
+        "fxRateToBase": "1",
+        "assetCategory": category,
+        "symbol": symbol,
+        "description": f"{symbol} INSTRUMENT",
+        "conid": str(100000 + n % 5000),
+        "isin": isin,
+        "listingExchange": "NASDAQ",
+        "tradeID": str(500000000 + n),
+        "reportDate": trade_date.isoformat(),
+        "tradeDate": trade_date.isoformat(),
+        "tradeTime": "153000",
+        "settleDateTarget": (trade_date + timedelta(days=2)).isoformat(),
+        "transactionType": "ExchTrade",
+        "exchange": "ISLAND",
+        "quantity": str(quantity if buy_sell == "BUY" else -quantity),
+        "tradePrice": str(price),
+        "tradeMoney": str(round(quantity * price, 2)),
+        "proceeds": str(round(-quantity * price, 2)),
+        "taxes": "0",
+        "ibCommission": str(-round(rnd.uniform(0.35, 5), 2)),
+        "ibCommissionCurrency": currency,
+        "netCash": str(round(-quantity * price, 2)),
+        "closePrice": str(price),
+        "openCloseIndicator": rnd.choice(["O", "C"]),
+        "cost": str(round(quantity * price, 2)),
+        "fifoPnlRealized": "0",
+        "mtmPnl": "0",
+        "buySell": buy_sell,
+        "transactionID": str(1000000000 + n),
+        "ibOrderID": str(2000000000 + n),
+        "orderTime": f"{trade_date.strftime('%Y%m%d')};153000",
+        "levelOfDetail": "EXECUTION",
+        "orderType": "LMT",
+    })
+
+
+def make_cash_transactions(rnd: random.Random, n: int):
+    symbol, isin, currency = INSTRUMENTS[n % len(INSTRUMENTS)]
+    pay_date = START_DATE + timedelta(days=(n * 37) % 1800)
+    gross = round(rnd.uniform(5, 300), 2)
+    rows = []
+    for level in ("DETAIL", "SUMMARY"):
+        for cash_type, amount in (("Dividends", gross),
+                                  ("Withholding Tax", -round(gross * 0.15, 2))):
+            rows.append(element("CashTransaction", {
+                "accountId": ACCOUNT_ID,
+                "currency": currency,
+                "fxRateToBase": "1",
+                "assetCategory": "STK",
+                "symbol": symbol,
+                "description": f"{symbol}({isin}) CASH DIVIDEND USD 0.24 PER SHARE",
+                "isin": isin,
+                "dateTime": f"{pay_date.strftime('%Y%m%d')};202000",
+                "settleDate": pay_date.isoformat(),
+                "reportDate": pay_date.isoformat(),
+                "exDate": (pay_date - timedelta(days=14)).isoformat(),
+                "amount": str(amount),
+                "type": cash_type,
+                "transactionID": str(3000000000 + n * 4 + len(rows)),
+                "levelOfDetail": level,
+            }))
+    return rows
+
+
+def make_flex_statement(trade_count: int, seed: int = 42) -> bytes:
+    rnd = random.Random(seed)
+    end_date = START_DATE + timedelta(days=1800)
+    lines = [
+        '<FlexQueryResponse queryName="sync" type="AF">',
+        '<FlexStatements count="1">',
+        element("FlexStatement", {
+            "accountId": ACCOUNT_ID,
+            "fromDate": START_DATE.isoformat(),
+            "toDate": end_date.isoformat(),
+            "period": "Last365CalendarDays",
+            "whenGenerated": f"{end_date.strftime('%Y%m%d')};120000",
+        })[:-3] + ">",
+        "<CashReport>",
+    ]
+    for currency, ending in (("BASE_SUMMARY", 12345.67), ("USD", 10000.5)):
+        lines.append(element("CashReportCurrency", {
+            "accountId": ACCOUNT_ID,
+            "currency": currency,
+            "fromDate": START_DATE.isoformat(),
+            "toDate": end_date.isoformat(),
+            "startingCash": "0",
+            "endingCash": str(ending),
+            "endingCashPaxos": "0",
+        }))
+    lines.append("</CashReport>")
+    lines.append("<Trades>")
+    lines.extend(make_trade(rnd, n) for n in range(trade_count))
+    lines.append("</Trades>")
+    lines.append("<CashTransactions>")
+    for n in range(max(1, trade_count // 20)):
+        lines.extend(make_cash_transactions(rnd, n))
+    lines.append("</CashTransactions>")
+    lines.append("</FlexStatement>")
+    lines.append("</FlexStatements>")
+    lines.append("</FlexQueryResponse>")
+    return "\n".join(lines).encode()
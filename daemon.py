@@ -0,0 +1,113 @@
+import random
+import signal
+import sys
+import threading
+import time
+
+import requests
+
+import LoggerFactory
+import main
+from EnvironmentConfiguration import EnvironmentConfiguration
+
+HEALTHY = "HEALTHY"
+UNHEALTHY = "DOH!"
+# operations that make sense to repeat on a schedule
+SCHEDULED_OPERATIONS = {main.SYNCIBKR, main.RECONCILE}
+
+envConf = EnvironmentConfiguration()
+logger = LoggerFactory.logger
+
+
+class Scheduler:
+    """
+    Runs a job every interval seconds, delayed by up to jitter seconds.
+
+    Runs never overlap: the job runs on the scheduler thread, and start times
+    that pass while a run is still going are skipped, not queued up.
+    """
+
+    def __init__(self, interval, jitter, stop_event: threading.Event):
+        self.interval = interval
+        self.jitter = jitter
+        self.stop_event = stop_event
+
+    def run_forever(self, job):
+        next_run = time.monotonic()
+        while not self.stop_event.is_set():
+            delay = next_run - time.monotonic() + random.uniform(0, self.jitter)
+            if self.stop_event.wait(max(0.0, delay)):
+                break
+            try:
+                job()
+            except Exception as e:
+                logger.exception(f"Scheduled run failed: {e}")
+            next_run += self.interval
+            now = time.monotonic()
+            if next_run <= now:
+                skipped = int((now - next_run) // self.interval) + 1
+                logger.warning(f"Sync took longer than the interval, "
+                               f"skipping {skipped} scheduled runs")
+                next_run += skipped * self.interval
+
+
+def write_health(healthy):
+    with open(envConf.health_file(), 'w') as outfile:
+        outfile.write(f"{HEALTHY if healthy else UNHEALTHY}\n")
+
+
+def call_healthcheck():
+    url = envConf.healthcheck_url()
+    if not url:
+        return
+    try:
+        requests.get(url, timeout=10)
+    except Exception as e:
+        logger.warning(f"Healthcheck {url} failed: {e}")
+
+
+class SyncDaemon:
+    """
+    Keeps the syncs of all configured accounts, with their connection pools,
+    caches and resolved platform ids, alive between scheduled runs.
+    """
+
+    def __init__(self):
+        self.syncs = {}
+        self.stop_event = threading.Event()
+        self.scheduler = Scheduler(envConf.sync_interval(),
+                                   envConf.sync_jitter(),
+                                   self.stop_event)
+
+    def run_once(self):
+        logger.info("Starting scheduled sync")
+        results = main.run_operations(self.syncs)
+        main.write_reports(results)
+        success = main.log_summary(results)
+        for sync in self.syncs.values():
+            sync.ghostfolio_api.reset_request_stats()
+        if success:
+            call_healthcheck()
+        write_health(success)
+        return success
+
+    def stop(self, signum=None, frame=None):
+        logger.info("Stopping after the current sync")
+        self.stop_event.set()
+
+    def run(self):
+        logger.info(f"Syncing every {self.scheduler.interval / 60:g} minutes, "
+                    f"with up to {self.scheduler.jitter:g}s jitter")
+        self.scheduler.run_forever(self.run_once)
+
+
+if __name__ == '__main__':
+    unscheduled = set(main.get_accounts().operations) - SCHEDULED_OPERATIONS
+    if unscheduled:
+        logger.error(f"Operations {sorted(unscheduled)} can not be scheduled, "
+                     f"use main.py to run them once")
+        sys.exit(1)
+    daemon = SyncDaemon()
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run()
@@ -17,6 +17,11 @@ cron_run(){
   supercronic "$CRON_FILE"
 }
 
+daemon_run(){
+  echo "Starting daemon, syncing every ${SYNC_INTERVAL:-60} minutes"
+  "$VIRTUAL_ENV/bin/python3" daemon.py
+}
+
 handle_migration(){
   if cmp -s "$VERSION_ACTUAL" "$VERSION_LAST_RUN"; then
       echo "The version has not changed. Nothing to do..."
@@ -41,7 +46,9 @@ handle_migration
 
 echo "STARTING" > "$HEALTH_FILE"
 
-if [ -z "$CRON" ]; then
+if [ "$(echo "$DAEMON" | tr '[:lower:]' '[:upper:]')" = "TRUE" ]; then
+  daemon_run
+elif [ -z "$CRON" ]; then
   single_run
 else
   cron_run
@@ -1,44 +1,179 @@
+import functools
 import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import CacheManager
 import LoggerFactory
+import RunMetrics
+import SyncPlan
+from EnvironmentConfiguration import EnvironmentConfiguration
 from GhostfolioApi import GhostfolioConfig
 from IbkrApi import IbkrConfig
 from SyncIBKR import SyncIBKR
 
 SYNCIBKR = "SYNCIBKR"
 DELETEALL = "DELETEALL"
+RECONCILE = "RECONCILE"
 GETALLACTS = "GETALLACTS"
+PLAN = "PLAN"
+APPLYPLAN = "APPLYPLAN"
+CACHESTATS = "CACHESTATS"
+CACHEPRUNE = "CACHEPRUNE"
+CACHEINVALIDATE = "CACHEINVALIDATE"
+CACHE_OPERATIONS = {CACHESTATS, CACHEPRUNE, CACHEINVALIDATE}
 
-ghost_tokens = os.environ.get('GHOST_TOKEN').split(",")
-ibkr_tokens = os.environ.get("IBKR_TOKEN").split(",")
-ibkr_queries = os.environ.get("IBKR_QUERY").split(",")
-ghost_hosts = os.environ.get("GHOST_HOST", "https://ghostfol.io").split(",")
-ghost_currency = os.environ.get("GHOST_CURRENCY", "USD").split(",")
-operations = os.environ.get("OPERATION", SYNCIBKR).split(",")
-
+envConf = EnvironmentConfiguration()
 logger = LoggerFactory.logger
 
-if __name__ == '__main__':
-    for i in range(len(operations)):
-        ghost = SyncIBKR(
-            IbkrConfig(
-                ibkr_tokens[i],
-                ibkr_queries[i]),
-            GhostfolioConfig(
-                ghost_tokens[i],
-                ghost_hosts[i],
-                ghost_currency[i],
-                "IBKR",
-                None,
-                "Interactive Brokers"
-            ),
-        )
-        if operations[i] == SYNCIBKR:
+RunResult = namedtuple('RunResult', 'label operation success seconds metrics')
+AccountsConfig = namedtuple('AccountsConfig',
+                            'ghost_tokens ibkr_tokens ibkr_queries ghost_hosts '
+                            'ghost_currency operations parallelism')
+
+
+@functools.lru_cache(maxsize=None)
+def get_accounts() -> AccountsConfig:
+    """The configured accounts, read when first needed, not on import."""
+    return AccountsConfig(
+        os.environ.get('GHOST_TOKEN').split(","),
+        os.environ.get("IBKR_TOKEN").split(","),
+        os.environ.get("IBKR_QUERY").split(","),
+        os.environ.get("GHOST_HOST", "https://ghostfol.io").split(","),
+        os.environ.get("GHOST_CURRENCY", "USD").split(","),
+        os.environ.get("OPERATION", SYNCIBKR).split(","),
+        int(os.environ.get("PARALLELISM", "1")),
+    )
+
+
+def create_sync(i) -> SyncIBKR:
+    accounts = get_accounts()
+    return SyncIBKR(
+        IbkrConfig(
+            accounts.ibkr_tokens[i],
+            accounts.ibkr_queries[i]),
+        GhostfolioConfig(
+            accounts.ghost_tokens[i],
+            accounts.ghost_hosts[i],
+            accounts.ghost_currency[i],
+            "IBKR",
+            None,
+            "Interactive Brokers"
+        ),
+    )
+
+
+def run_operation(i, syncs=None) -> RunResult:
+    """
+    Runs the operation of the i-th account. With syncs, a dict kept by the
+    caller, the SyncIBKR of an account is created once and reused by later
+    runs, keeping its connection pool and platform id.
+    """
+    accounts = get_accounts()
+    operation = accounts.operations[i]
+    label = f"#{i + 1} {accounts.ibkr_queries[i]}"
+    LoggerFactory.set_log_prefix(label)
+    metrics = RunMetrics.start_run(label, operation)
+    start = time.perf_counter()
+    ghost = None
+    try:
+        if operation not in CACHE_OPERATIONS:
+            with metrics.span("setup"):
+                if syncs is None:
+                    ghost = create_sync(i)
+                else:
+                    if i not in syncs:
+                        syncs[i] = create_sync(i)
+                    ghost = syncs[i]
+        if operation == SYNCIBKR:
             logger.info("Starting sync")
-            ghost.sync_ibkr()
+            success = ghost.sync_ibkr()
             logger.info("End sync")
-        elif operations[i] == DELETEALL:
+        elif operation == RECONCILE:
+            logger.info("Starting full reconcile")
+            success = ghost.sync_ibkr(full_reconcile=True)
+            logger.info("End full reconcile")
+        elif operation == PLAN:
+            logger.info("Starting plan")
+            SyncPlan.save(ghost.plan_sync(),
+                          envConf.sync_plan_file(accounts.ibkr_queries[i]))
+            success = True
+            logger.info("End plan")
+        elif operation == APPLYPLAN:
+            logger.info("Starting apply plan")
+            plan_file = envConf.sync_plan_file(accounts.ibkr_queries[i])
+            result = ghost.apply_plan(SyncPlan.load(plan_file))
+            # failed writes are retried by the next sync, not by this plan
+            if result.applied:
+                SyncPlan.remove(plan_file)
+            success = result.success
+            logger.info("End apply plan")
+        elif operation in CACHE_OPERATIONS:
+            success = run_cache_operation(operation)
+        elif operation == DELETEALL:
             logger.info("Starting delete")
-            ghost.delete_all_activities()
+            success = ghost.delete_all_activities()
             logger.info("End delete")
         else:
             logger.warning("Unknown Operation")
+            success = False
+    except Exception as e:
+        logger.exception(f"{operation} failed: {e}")
+        success = False
+    seconds = time.perf_counter() - start
+    if ghost is not None:
+        metrics.set_http_stats(ghost.ghostfolio_api.get_request_stats())
+    metrics.finish(bool(success), seconds)
+    return RunResult(label, operation, bool(success), seconds, metrics)
+
+
+def run_cache_operation(operation):
+    """Cache operations work on the caches of all accounts, no sync needed."""
+    if operation == CACHEPRUNE:
+        CacheManager.prune()
+    elif operation == CACHEINVALIDATE:
+        if not CacheManager.invalidate(envConf.cache_invalidate()):
+            return False
+    return CacheManager.log_stats()
+
+
+def run_operations(syncs=None) -> list[RunResult]:
+    accounts = get_accounts()
+    runs = range(len(accounts.operations))
+    if accounts.parallelism > 1:
+        logger.info(f"Running {len(accounts.operations)} operations, "
+                    f"{accounts.parallelism} in parallel")
+        with ThreadPoolExecutor(max_workers=accounts.parallelism,
+                                thread_name_prefix="sync") as executor:
+            return list(executor.map(lambda i: run_operation(i, syncs), runs))
+    return [run_operation(i, syncs) for i in runs]
+
+
+def log_summary(results: list[RunResult]):
+    LoggerFactory.set_log_prefix(None)
+    failed = [result for result in results if not result.success]
+    for result in results:
+        log = logger.info if result.success else logger.error
+        log(f"{result.label} {result.operation}: "
+            f"{'OK' if result.success else 'FAILED'} in {result.seconds:.1f}s")
+    logger.info(f"Finished {len(results)} operations, {len(failed)} failed")
+    return len(failed) == 0
+
+
+def write_reports(results: list[RunResult]):
+    runs = [result.metrics for result in results]
+    try:
+        RunMetrics.write_report(envConf.run_report_file(), runs)
+        if envConf.prometheus_textfile():
+            RunMetrics.write_prometheus_textfile(envConf.prometheus_textfile(), runs)
+    except OSError as e:
+        logger.warning(f"Writing the run report failed: {e}")
+
+
+if __name__ == '__main__':
+    run_results = run_operations()
+    write_reports(run_results)
+    if not log_summary(run_results):
+        sys.exit(1)